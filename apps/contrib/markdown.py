@@ -0,0 +1,30 @@
+import hashlib
+
+from markdownx.models import MarkdownxField
+from markdownx.utils import markdownify as markdownx_markdownify
+
+from django.core.cache import cache
+
+
+MARKDOWN_CACHE_TIMEOUT = 7 * 24 * 60 * 60
+
+
+def _cache_key(text):
+    return 'lrex-markdown-{}'.format(hashlib.sha1(text.encode()).hexdigest())
+
+
+def markdownify(text):
+    if not text:
+        return ''
+    key = _cache_key(text)
+    html = cache.get(key)
+    if html is None:
+        html = markdownx_markdownify(text)
+        cache.set(key, html, MARKDOWN_CACHE_TIMEOUT)
+    return html
+
+
+def render_markdown_fields(Model, instance):
+    for field in Model._meta.fields:
+        if isinstance(field, MarkdownxField) and getattr(instance, field.name):
+            markdownify(getattr(instance, field.name))
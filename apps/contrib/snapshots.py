@@ -0,0 +1,184 @@
+import hashlib
+import io
+import os
+import queue
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+
+
+def snapshot_path(name):
+    return os.path.join(settings.LREX_EXPORT_SNAPSHOT_DIR, name)
+
+
+def snapshot_last_modified(name):
+    try:
+        return int(os.path.getmtime(snapshot_path(name)))
+    except OSError:
+        return None
+
+
+def _touch(path):
+    # the access time orders the snapshots for eviction, the modification time is the Last-Modified date
+    os.utime(path, (time.time(), os.path.getmtime(path)))
+
+
+def evict_snapshots(keep=None, prefix=None):
+    directory = settings.LREX_EXPORT_SNAPSHOT_DIR
+    snapshots = []
+    for entry in os.scandir(directory):
+        if not entry.is_file() or entry.name.endswith('.tmp') or entry.path == keep:
+            continue
+        if prefix and entry.name.startswith(prefix):
+            os.remove(entry.path)
+            continue
+        stat = entry.stat()
+        snapshots.append((stat.st_atime, stat.st_size, entry.path))
+    total_size = sum(size for _, size, _ in snapshots)
+    if keep:
+        total_size += os.path.getsize(keep)
+    for _, size, path in sorted(snapshots):
+        if total_size <= settings.LREX_EXPORT_SNAPSHOT_MAX_BYTES:
+            break
+        os.remove(path)
+        total_size -= size
+
+
+class ProgressFile:
+    """Reports the size of the wrapped file to on_progress(bytes_written) at most once per interval."""
+
+    def __init__(self, fileobj, on_progress, interval=1.0):
+        self._fileobj = fileobj
+        self._on_progress = on_progress
+        self._interval = interval
+        self._last_report = time.monotonic()
+
+    def write(self, data):
+        result = self._fileobj.write(data)
+        if time.monotonic() - self._last_report >= self._interval:
+            self._fileobj.flush()
+            self._on_progress(os.fstat(self._fileobj.fileno()).st_size)
+            self._last_report = time.monotonic()
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self._fileobj, name)
+
+
+def get_snapshot(name, write, binary=False, stale_prefix=None):
+    """Returns the path of the snapshot file, writing it with write(fileobj) if it does not exist yet."""
+    path = snapshot_path(name)
+    if os.path.exists(path):
+        _touch(path)
+        return path
+    os.makedirs(settings.LREX_EXPORT_SNAPSHOT_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=settings.LREX_EXPORT_SNAPSHOT_DIR, suffix='.tmp')
+    try:
+        if binary:
+            with open(fd, 'wb') as fileobj:
+                write(fileobj)
+        else:
+            with open(fd, 'w', newline='', encoding='utf-8') as fileobj:
+                write(fileobj)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    evict_snapshots(keep=path, prefix=stale_prefix)
+    return path
+
+
+class _ChunkPipe(io.RawIOBase):
+    """Unseekable file object passing the written bytes in chunks to the thread iterating over it."""
+
+    _END = object()
+
+    def __init__(self, chunk_size, max_chunks):
+        super().__init__()
+        self._chunk_size = chunk_size
+        self._chunks = queue.Queue(max_chunks)
+        self._buffer = bytearray()
+        self._cancelled = threading.Event()
+
+    def _put(self, item):
+        while True:
+            if self.is_cancelled:
+                raise OSError('Snapshot stream closed.')
+            try:
+                self._chunks.put(item, timeout=1)
+                return
+            except queue.Full:
+                pass
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer += data
+        if len(self._buffer) >= self._chunk_size:
+            self._put(bytes(self._buffer))
+            self._buffer.clear()
+        return len(data)
+
+    def finish(self, error=None):
+        if not error and self._buffer:
+            self._put(bytes(self._buffer))
+        self._put(error or self._END)
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def is_cancelled(self):
+        return self._cancelled.is_set()
+
+    def chunks(self):
+        while True:
+            chunk = self._chunks.get()
+            if chunk is self._END:
+                return
+            if isinstance(chunk, BaseException):
+                raise chunk
+            yield chunk
+
+
+def stream_snapshot(name, write, binary=False, stale_prefix=None, chunk_size=64 * 1024, max_chunks=16):
+    """Yields the bytes written by write(fileobj) in a separate thread and stores them as the snapshot when done."""
+    os.makedirs(settings.LREX_EXPORT_SNAPSHOT_DIR, exist_ok=True)
+    path = snapshot_path(name)
+    fd, tmp_path = tempfile.mkstemp(dir=settings.LREX_EXPORT_SNAPSHOT_DIR, suffix='.tmp')
+    pipe = _ChunkPipe(chunk_size, max_chunks)
+
+    def produce():
+        try:
+            if binary:
+                write(pipe)
+            else:
+                with io.TextIOWrapper(pipe, encoding='utf-8', newline='') as fileobj:
+                    write(fileobj)
+            pipe.finish()
+        except Exception as e:
+            if not pipe.is_cancelled:
+                pipe.finish(error=e)
+        finally:
+            connection.close()
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        with open(fd, 'wb') as snapshot:
+            for chunk in pipe.chunks():
+                snapshot.write(chunk)
+                yield chunk
+        os.replace(tmp_path, path)
+    except BaseException:
+        pipe.cancel()
+        os.remove(tmp_path)
+        raise
+    evict_snapshots(keep=path, prefix=stale_prefix)
+
+
+def snapshot_version(*parts):
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
@@ -1,8 +1,8 @@
-from markdownx.utils import markdownify as markdownx_markdownify
-
 from django import template
 from django.utils.safestring import mark_safe
 
+from apps.contrib.markdown import markdownify as contrib_markdownify
+
 
 register = template.Library()
 
@@ -24,4 +24,4 @@ def bootstrap_alert_class(message_level):
 @register.filter
 def markdownify(text):
     if text:
-        return mark_safe(markdownx_markdownify(text))
+        return mark_safe(contrib_markdownify(text))
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 02:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lrex_item', '0003_alter_itemfeedback_scale_values'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='updated',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
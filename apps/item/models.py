@@ -3,6 +3,7 @@ from django.db import models
 from django.urls import reverse
 from django.utils.functional import cached_property
 
+from apps.contrib.markdown import render_markdown_fields
 from apps.contrib.utils import slugify_unique, split_list_string, strip_html_in_markdown_fields
 from apps.study.models import ScaleValue
 
@@ -29,17 +30,24 @@ class Item(models.Model):
         help_text='Number of the questionnaire block in which the item will appear.',
         default=1
     )
+    updated = models.DateTimeField(
+        auto_now=True,
+    )
 
     class Meta:
         ordering = ['number', 'condition']
 
+    @staticmethod
+    def compute_materials_block(block, materials_block, materials_is_example):
+        if materials_is_example:
+            return 0
+        if materials_block > 0:
+            return materials_block
+        return block
+
     @property
     def materials_block(self):
-        if self.materials.is_example:
-            return 0
-        if self.materials.block > 0:
-            return self.materials.block
-        return self.block
+        return self.compute_materials_block(self.block, self.materials.block, self.materials.is_example)
 
     def content(self, study):
         if study.has_text_items:
@@ -79,7 +87,9 @@ class MarkdownItem(Item):
 
     def save(self, *args, **kwargs):
         strip_html_in_markdown_fields(MarkdownItem, self)
-        return super().save(*args, **kwargs)
+        result = super().save(*args, **kwargs)
+        render_markdown_fields(MarkdownItem, self)
+        return result
 
 
 class AudioLinkItem(Item):
@@ -99,7 +109,9 @@ class AudioLinkItem(Item):
 
     def save(self, *args, **kwargs):
         strip_html_in_markdown_fields(AudioLinkItem, self)
-        return super().save(*args, **kwargs)
+        result = super().save(*args, **kwargs)
+        render_markdown_fields(AudioLinkItem, self)
+        return result
 
     @cached_property
     def urls_list(self):
@@ -167,6 +179,10 @@ class ItemQuestion(models.Model):
     def __str__(self):
         return '{}{}'.format(self.item, self.number)
 
+    @cached_property
+    def scale_labels_list(self):
+        return split_list_string(self.scale_labels) if self.scale_labels else []
+
 
 class ItemFeedback(models.Model):
     item = models.ForeignKey(
@@ -194,5 +210,9 @@ class ItemFeedback(models.Model):
     class Meta:
         ordering = ['item', 'question', 'pk']
 
+    @cached_property
+    def scale_values_list(self):
+        return split_list_string(self.scale_values)
+
     def show_feedback(self, scale_value):
-        return scale_value.label in split_list_string(self.scale_values)
+        return scale_value.label in self.scale_values_list
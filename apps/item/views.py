@@ -430,6 +430,10 @@ class ItemQuestionsUpdateView(
         form.instance.item = self.item
         super().save_form(form, number)
 
+    def formset_valid(self):
+        super().formset_valid()
+        self.study.bump_version()
+
     def submit_redirect(self):
         return self.redirect_paginated('items', materials_slug=self.materials.slug)
 
@@ -468,6 +472,10 @@ class ItemFeedbackUpdateView(
         form.instance.item = self.item
         super().save_form(form, number)
 
+    def formset_valid(self):
+        super().formset_valid()
+        self.study.bump_version()
+
     def submit_redirect(self):
         return self.redirect_paginated('items', materials_slug=self.materials.slug)
 
@@ -0,0 +1,108 @@
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+STATISTICS_FIELDS = ['n', 'mean', 'sd', 'mean_z', 'sd_z']
+
+
+def _n_mean_sd(values, mask, axis):
+    n = mask.sum(axis=axis)
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        mean = numpy.where(mask, values, 0).sum(axis=axis) / n
+        deviations = numpy.where(mask, values - numpy.expand_dims(mean, axis), 0)
+        sd = numpy.where(n > 1, numpy.sqrt((deviations ** 2).sum(axis=axis) / (n - 1)), numpy.nan)
+    return n, mean, sd
+
+
+def _float_or_none(value):
+    return None if numpy.isnan(value) else float(value)
+
+
+class RatingMatrix:
+    """
+    Ratings of a set of materials as dense participant x item x question arrays of scale positions (counted
+    from 1), with a mask of the rated cells. Participants are ordered like the results (tests last), items by
+    number and condition.
+    """
+
+    def __init__(self, ratings, items, n_questions):
+        # ratings: rows of (trial_id, participant, is_test, item_id, question, scale value number)
+        # items: (item_id, number, condition) ordered by number and condition
+        ratings = numpy.asarray(ratings, dtype=numpy.int64).reshape(-1, 6)
+        item_ids = numpy.array([item_id for item_id, _, _ in items], dtype=numpy.int64)
+        self.item_numbers = numpy.array([number for _, number, _ in items], dtype=numpy.int64)
+        self.conditions, self.item_conditions = numpy.unique(
+            numpy.array([condition for _, _, condition in items], dtype=str), return_inverse=True,
+        )
+        _, first, trial_index = numpy.unique(ratings[:, 0], return_index=True, return_inverse=True)
+        participants = ratings[first, 1]
+        is_test = ratings[first, 2].astype(bool)
+        order = numpy.lexsort((participants, is_test))
+        participant_rank = numpy.empty_like(order)
+        participant_rank[order] = numpy.arange(len(order))
+        self.participants = participants[order]
+        self.is_test = is_test[order]
+        item_sorter = numpy.argsort(item_ids)
+        item_index = item_sorter[numpy.searchsorted(item_ids, ratings[:, 3], sorter=item_sorter)]
+        shape = (len(self.participants), len(item_ids), n_questions)
+        self.ratings = numpy.zeros(shape, dtype=numpy.int8)
+        self.rated = numpy.zeros(shape, dtype=bool)
+        cells = (participant_rank[trial_index.ravel()], item_index, ratings[:, 4])
+        self.ratings[cells] = ratings[:, 5] + 1
+        self.rated[cells] = True
+
+    @property
+    def n_questions(self):
+        return self.ratings.shape[2]
+
+    def z_scores(self):
+        """Ratings normalized per participant and question, NaN if not rated or not defined."""
+        _, mean, sd = _n_mean_sd(self.ratings, self.rated, axis=1)
+        sd[sd == 0] = numpy.nan
+        z_scores = (self.ratings - mean[:, numpy.newaxis, :]) / sd[:, numpy.newaxis, :]
+        z_scores[~self.rated] = numpy.nan
+        return z_scores
+
+    def condition_statistics(self):
+        """Statistics per condition and question, without test trials like the aggregated results."""
+        participants = ~self.is_test
+        z_scores = self.z_scores()[participants]
+        ratings = self.ratings[participants]
+        rated = self.rated[participants]
+        statistics = []
+        for condition_index, condition in enumerate(self.conditions):
+            items = self.item_conditions == condition_index
+            values = ratings[:, items, :].reshape(-1, self.n_questions)
+            mask = rated[:, items, :].reshape(-1, self.n_questions)
+            z_values = z_scores[:, items, :].reshape(-1, self.n_questions)
+            n, mean, sd = _n_mean_sd(values, mask, axis=0)
+            _, mean_z, sd_z = _n_mean_sd(z_values, ~numpy.isnan(z_values), axis=0)
+            statistics.append({
+                'condition': str(condition),
+                'questions': [
+                    {
+                        'n': int(n[question]),
+                        'mean': _float_or_none(mean[question]),
+                        'sd': _float_or_none(sd[question]),
+                        'mean_z': _float_or_none(mean_z[question]),
+                        'sd_z': _float_or_none(sd_z[question]),
+                    }
+                    for question in range(self.n_questions)
+                ],
+            })
+        return statistics
+
+    def z_score_rows(self):
+        z_scores = self.z_scores()
+        for participant, item, question in zip(*numpy.nonzero(self.rated)):
+            yield (
+                int(self.participants[participant]),
+                bool(self.is_test[participant]),
+                int(self.item_numbers[item]),
+                str(self.conditions[self.item_conditions[item]]),
+                int(question) + 1,
+                int(self.ratings[participant, item, question]),
+                _float_or_none(z_scores[participant, item, question]),
+            )
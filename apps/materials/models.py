@@ -1,11 +1,12 @@
-import copy
 import csv
 from collections import Counter
 from enum import Enum
 from itertools import groupby
 from string import ascii_lowercase
 
+from django.conf import settings
 from django.db import models
+from django.db.models import Count, Q, Sum
 from django.urls import reverse
 from django.utils.functional import cached_property
 
@@ -14,6 +15,8 @@ from apps.contrib.utils import slugify_unique, split_list_string
 from apps.item import models as item_models
 from apps.trial import models as trial_models
 
+from . import analytics
+
 
 class MaterialsSteps(Enum):
     STEP_EXP_ITEMS_CREATE = 1
@@ -289,107 +292,89 @@ class Materials(models.Model):
             item_list.items.set(list(self.items_sorted_by_block))
 
     def results(self):
-        ratings = trial_models.Rating.objects.filter(
-            questionnaire_item__item__materials=self,
-        ).prefetch_related(
-            'scale_value',
-            'trial',
-            'trial__questionnaire',
-            'trial__questionnaire__study',
-            'questionnaire_item',
-            'questionnaire_item__item',
-            'questionnaire_item__item__textitem',
-            'questionnaire_item__item__audiolinkitem',
-            'questionnaire_item__item__markdownitem',
-            'questionnaire_item__question_properties',
-        )
-        has_question_with_random_scale = self.study.has_question_with_random_scale
-        results = {}
-        for rating in ratings:
-            participant = rating.trial.number
-            item = rating.questionnaire_item.item
-            key = '{:03d}-{:03d}{}'.format(participant, item.number, item.condition)
-            if rating.trial.is_test:
-                key = 'test-' + key
-            if key in results:
-                row = results[key]
-                row['questions'].append(rating.question)
-                row['ratings'].append(rating.scale_value.number)
-                row['labels'].append(rating.scale_value.label)
-                row['comments'].append(rating.comment)
-            else:
-                row = {
-                    'participant': participant,
-                    'is_test_trial': 'yes' if rating.trial.is_test else 'no',
-                    'item': item.number,
-                    'condition': item.condition,
-                    'position': rating.questionnaire_item.number + 1,
-                    'content': item.content(self.study),
-                    'questions': [rating.question],
-                    'ratings': [rating.scale_value.number],
-                    'labels': [rating.scale_value.label],
-                    'comments': [rating.comment],
-                }
-                if self.study.pseudo_randomize_question_order:
-                    row['question_order'] = rating.questionnaire_item.question_order_user
-                if has_question_with_random_scale:
-                    row['random_scale'] = '\n'.join(
-                        q_property.question_scale_user
-                        for q_property in rating.questionnaire_item.question_properties.all()
-                    )
-                results[key] = row
-        results_sorted = [results[key] for key in sorted(results)]
-        return results_sorted
-
-    def _aggregated_results(self, results, group_function, key_function):
-        grouped_results = {}
-        for item, results in groupby(results, group_function):
-            if item in grouped_results:
-                grouped_results[item].extend(list(results))
-            else:
-                grouped_results[item] = list(results)
-        questions = list(self.study.questions.prefetch_related('scale_values').all())
-        aggregated_results = {}
-        for results_for_item in grouped_results.values():
-            rating_count = len(results_for_item)
-            aggregated_result = copy.deepcopy(results_for_item[0])
-            aggregated_result['scale_count'] = [None] * len(questions)
-            for question in questions:
-                aggregated_result['scale_count'][question.number] = {
-                    scale_value.number: 0 for scale_value in question.scale_values.all()
-                }
-                for result in results_for_item:
-                    aggregated_result['scale_count'][question.number][result['ratings'][question.number]] +=1
-
-            aggregated_result['scale_ratings'] = {}
-            aggregated_result['scale_ratings_flat'] = []
-            for question_scale_count in aggregated_result['scale_count']:
-                for scale, count in question_scale_count.items():
-                    rating = count / rating_count
-                    aggregated_result['scale_ratings'].update({scale: rating})
-                    aggregated_result['scale_ratings_flat'].append(rating)
+        for _, row in self.study.results(materials=self):
+            yield row
 
+    RATING_AGGREGATE_FIELDS = {
+        'participant': 'participant',
+        'item': 'item__number',
+        'condition': 'condition',
+    }
+    RATING_FIELDS = {
+        'participant': 'trial__number',
+        'item': 'questionnaire_item__item__number',
+        'condition': 'questionnaire_item__item__condition',
+    }
+    AGGREGATED_RESULTS_COLUMNS = [['condition'], ['item', 'condition'], ['participant', 'condition']]
+
+    def _aggregated_results_source(self, columns):
+        if settings.LREX_RATING_AGGREGATE_TABLE:
+            fields = [self.RATING_AGGREGATE_FIELDS[column] for column in columns]
+            return self.rating_aggregates.all(), fields, Sum, 'count'
+        fields = [self.RATING_FIELDS[column] for column in columns]
+        ratings = trial_models.Rating.objects.filter(questionnaire_item__item__materials=self)
+        return ratings, fields, Count, 'pk'
+
+    def aggregated_result_groups(self, columns):
+        if columns not in self.AGGREGATED_RESULTS_COLUMNS:
+            return self.rating_aggregates.none()
+        source, fields, aggregate, count_field = self._aggregated_results_source(columns)
+        return source.values(*fields).annotate(
+            rating_count=aggregate(count_field, filter=Q(question=0)),
+        ).order_by(*fields)
+
+    def _aggregated_results(self, columns, groups, scale_value_counts):
+        _, fields, _, _ = self._aggregated_results_source(columns)
+        counts = {}
+        for scale_value_count in scale_value_counts:
+            key = tuple(scale_value_count[field] for field in fields)
+            counts[(key, scale_value_count['scale_value_id'])] = scale_value_count['n_ratings']
+        bundle = self.study.participation_bundle
+        questions = [bundle.question(number) for number in sorted(bundle.questions)]
+        aggregated_results = []
+        for group in groups:
+            key = tuple(group[field] for field in fields)
+            rating_count = group['rating_count']
+            aggregated_result = {column: group[field] for column, field in zip(columns, fields)}
             aggregated_result['rating_count'] = rating_count
-            aggregated_results.update({key_function(aggregated_result): aggregated_result})
-        aggregated_results_sorted = [aggregated_results[key] for key in sorted(aggregated_results)]
-        return aggregated_results_sorted
+            aggregated_result['scale_count'] = [
+                {
+                    scale_value.number: counts.get((key, scale_value.pk), 0)
+                    for scale_value in bundle.question_scale_values(question)
+                }
+                for question in questions
+            ]
+            aggregated_result['scale_ratings_flat'] = [
+                count / rating_count
+                for question_scale_count in aggregated_result['scale_count']
+                for count in question_scale_count.values()
+            ]
+            aggregated_results.append(aggregated_result)
+        return aggregated_results
+
+    def _scale_value_counts(self, columns, source_filter=None):
+        source, fields, aggregate, count_field = self._aggregated_results_source(columns)
+        if source_filter is not None:
+            source = source.filter(source_filter)
+        return source.values(*fields, 'scale_value_id').annotate(
+            n_ratings=aggregate(count_field),
+        ).order_by().iterator()
+
+    def aggregated_results_for_groups(self, columns, groups):
+        groups = list(groups)
+        if not groups:
+            return []
+        _, fields, _, _ = self._aggregated_results_source(columns)
+        groups_filter = Q()
+        for group in groups:
+            groups_filter |= Q(**{field: group[field] for field in fields})
+        return self._aggregated_results(columns, groups, self._scale_value_counts(columns, groups_filter))
 
     def aggregated_results(self, columns):
-        aggregated_results = []
-        results = self.results()
-        if columns == ['item', 'condition']:
-            group_function = lambda result: str(result['item']) + result['condition']
-            key_function = lambda result: '{:03d}-{}'.format(result['item'], result['condition'])
-            aggregated_results = self._aggregated_results(results, group_function, key_function)
-        elif columns == ['participant', 'condition']:
-            group_function = lambda result: str(result['participant']) + result['condition']
-            key_function = lambda result: '{:03d}-{}'.format(result['participant'], result['condition'])
-            aggregated_results = self._aggregated_results(results, group_function, key_function)
-        elif columns == ['condition']:
-            group_function = lambda result: result['condition']
-            key_function = lambda result: '{}'.format(result['condition'])
-            aggregated_results = self._aggregated_results(results, group_function, key_function)
-        return aggregated_results
+        if columns not in self.AGGREGATED_RESULTS_COLUMNS:
+            return []
+        groups = self.aggregated_result_groups(columns).iterator()
+        return self._aggregated_results(columns, groups, self._scale_value_counts(columns))
 
     def items_csv_header(self, add_materials_column=False, zero_index=False):
         csv_row = ['materials'] if add_materials_column else []
@@ -497,6 +482,7 @@ class Materials(models.Model):
 
         if item_questions:
             item_models.ItemQuestion.objects.bulk_create(item_questions)
+        self.study.bump_version()
 
     def item_feedbacks_csv_header(self, add_materials_column=False, **kwargs):
         csv_row = ['materials'] if add_materials_column else []
@@ -545,6 +531,7 @@ class Materials(models.Model):
                 scale_values=scale_values,
                 feedback=feedback
             )
+        self.study.bump_version()
 
     def itemlists_csv_header(self, add_materials_column=False, **kwargs):
         csv_row = ['materials'] if add_materials_column else []
@@ -597,25 +584,68 @@ class Materials(models.Model):
         csv_row.append('content')
         return csv_row
 
+    def results_csv_row(self, result):
+        csv_row = [
+            self.title, result['participant'], result['is_test_trial'], result['item'], result['condition'],
+            result['position']
+        ]
+        if self.study.pseudo_randomize_question_order:
+            csv_row.append(result['question_order'])
+        if self.study.has_question_with_random_scale:
+            csv_row.append(result['random_scale'])
+        for rating in result['labels']:
+            csv_row.append(rating)
+        if self.study.has_question_rating_comments:
+            for comment in result['comments']:
+                csv_row.append(comment if comment else '')
+        csv_row.append(result['content'])
+        return csv_row
+
+    def results_csv_rows(self):
+        for result in self.results():
+            yield self.results_csv_row(result)
+
     def results_csv(self, fileobj):
         writer = csv.writer(fileobj, delimiter=contrib_csv.DEFAULT_DELIMITER, quoting=contrib_csv.DEFAULT_QUOTING)
-        results = self.results()
-        for result in results:
-            csv_row = [
-                self.title, result['participant'], result['is_test_trial'], result['item'], result['condition'],
-                result['position']
-            ]
-            if self.study.pseudo_randomize_question_order:
-                csv_row.append(result['question_order'])
-            if self.study.has_question_with_random_scale:
-                csv_row.append(result['random_scale'])
-            for rating in result['labels']:
-                csv_row.append(rating)
-            if self.study.has_question_rating_comments:
-                for comment in result['comments']:
-                    csv_row.append(comment if comment else '')
-            csv_row.append(result['content'])
-            writer.writerow(csv_row)
+        writer.writerows(self.results_csv_rows())
+
+    @property
+    def has_analytics_support(self):
+        return analytics.numpy is not None
+
+    def rating_matrix(self, include_test_trials=True):
+        items = self.items.order_by('number', 'condition').values_list('pk', 'number', 'condition')
+        ratings = trial_models.Rating.objects.filter(questionnaire_item__item__materials=self)
+        if not include_test_trials:
+            ratings = ratings.filter(trial__is_test=False)
+        ratings = ratings.order_by().values_list(
+            'trial_id', 'trial__number', 'trial__is_test', 'questionnaire_item__item_id', 'question',
+            'scale_value__number',
+        )
+        return analytics.RatingMatrix(list(ratings), list(items), len(self.study.participation_bundle.questions))
+
+    def rating_statistics_csv(self, fileobj, rating_matrix=None):
+        rating_matrix = rating_matrix or self.rating_matrix()
+        writer = csv.writer(fileobj, delimiter=contrib_csv.DEFAULT_DELIMITER, quoting=contrib_csv.DEFAULT_QUOTING)
+        writer.writerow(['materials', 'condition', 'question'] + analytics.STATISTICS_FIELDS)
+        for condition_statistics in rating_matrix.condition_statistics():
+            for question, statistics in enumerate(condition_statistics['questions']):
+                writer.writerow(
+                    [self.title, condition_statistics['condition'], question + 1] +
+                    ['' if statistics[field] is None else statistics[field] for field in analytics.STATISTICS_FIELDS]
+                )
+
+    def z_scores_csv(self, fileobj, rating_matrix=None):
+        rating_matrix = rating_matrix or self.rating_matrix()
+        writer = csv.writer(fileobj, delimiter=contrib_csv.DEFAULT_DELIMITER, quoting=contrib_csv.DEFAULT_QUOTING)
+        writer.writerow([
+            'materials', 'participant', 'is_test_trial', 'item', 'condition', 'question', 'rating', 'z_score',
+        ])
+        for participant, is_test, item, condition, question, rating, z_score in rating_matrix.z_score_rows():
+            writer.writerow([
+                self.title, participant, 'yes' if is_test else 'no', item, condition, question, rating,
+                '' if z_score is None else z_score,
+            ])
 
     STEP_DESCRIPTION = {
         MaterialsSteps.STEP_EXP_ITEMS_CREATE: 'create or upload items',
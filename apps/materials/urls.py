@@ -11,5 +11,11 @@ urlpatterns = [
     path('<slug:materials_slug>/update/', views.MaterialsSettingsView.as_view(), name='materials-settings'),
     path('<slug:materials_slug>/delete/', views.MaterialsDeleteView.as_view(), name='materials-delete'),
     path('<slug:materials_slug>/results/', views.MaterialsResultsView.as_view(), name='materials-results'),
+    path('<slug:materials_slug>/results/statistics/csv/', views.MaterialsStatisticsCSVDownloadView.as_view(),
+         name='materials-results-statistics-csv'),
+    path('<slug:materials_slug>/results/statistics/json/', views.MaterialsStatisticsJSONDownloadView.as_view(),
+         name='materials-results-statistics-json'),
+    path('<slug:materials_slug>/results/z-scores/csv/', views.MaterialsZScoresCSVDownloadView.as_view(),
+         name='materials-results-zscores-csv'),
     path('<slug:materials_slug>/items/', include(item_urls.urlpatterns_materials)),
 ]
\ No newline at end of file
@@ -1,9 +1,13 @@
+import json
+
 from django.contrib import messages
 from django.contrib.messages.views import SuccessMessageMixin
 from django.core.paginator import Paginator
+from django.http import Http404, HttpResponse
 from django.urls import reverse
 from django.utils.functional import cached_property
 from django.utils.safestring import mark_safe
+from django.utils.timezone import now
 from django.views import generic
 
 from apps.contrib import views as contrib_views
@@ -161,12 +165,16 @@ class MaterialsResultsView(
         self.page = request.GET.get('page', self.page)
         self.aggregate_by_par = request.GET.get('aggregate_by', self.aggregate_by_par)
         self.aggregate_by = self.aggregate_by_par.split(',')
+        self.show_statistics = bool(request.GET.get('statistics', False))
         return super().get(request, *args, **kwargs)
 
     def _aggregated_results(self):
-        results = self.object.aggregated_results(self.aggregate_by)
-        paginator = Paginator(results, self.paginate_by)
+        groups = self.object.aggregated_result_groups(self.aggregate_by)
+        paginator = Paginator(groups, self.paginate_by)
         results_on_page = paginator.get_page(self.page)
+        results_on_page.object_list = self.object.aggregated_results_for_groups(
+            self.aggregate_by, results_on_page.object_list
+        )
         return results_on_page
 
     def get_context_data(self, **kwargs):
@@ -178,5 +186,67 @@ class MaterialsResultsView(
             'active_materials': self.materials.pk,
             'results': self._aggregated_results(),
             'aggregate_by': self.aggregate_by,
+            'aggregate_by_par': self.aggregate_by_par,
+            'show_statistics': self.show_statistics,
         })
+        # the statistics load all ratings of the materials, so they are only computed when asked for
+        if self.show_statistics and self.materials.has_analytics_support:
+            context['statistics'] = self.materials.rating_matrix(include_test_trials=False).condition_statistics()
         return context
+
+
+class MaterialsAnalyticsDownloadMixin(
+    MaterialsMixin,
+    study_views.CheckStudyCreatorMixin,
+):
+    export_label = None
+    export_extension = 'csv'
+    content_type = 'text/csv'
+
+    def get_filename(self):
+        return '{}_{}_{}_{}.{}'.format(
+            self.study.title.replace(' ', '_'), self.materials.title.replace(' ', '_'), self.export_label,
+            now().strftime('%Y-%m-%d-%H%M'), self.export_extension,
+        )
+
+    def write(self, response):
+        raise NotImplementedError
+
+    def get(self, request, *args, **kwargs):
+        if not self.materials.has_analytics_support:
+            raise Http404()
+        response = HttpResponse(content_type=self.content_type)
+        response['Content-Disposition'] = 'attachment; filename="{}"'.format(self.get_filename())
+        self.write(response)
+        return response
+
+
+class MaterialsStatisticsCSVDownloadView(MaterialsAnalyticsDownloadMixin, generic.View):
+    export_label = 'STATISTICS'
+
+    def write(self, response):
+        self.materials.rating_statistics_csv(response)
+
+
+class MaterialsZScoresCSVDownloadView(MaterialsAnalyticsDownloadMixin, generic.View):
+    export_label = 'ZSCORES'
+
+    def write(self, response):
+        self.materials.z_scores_csv(response)
+
+
+class MaterialsStatisticsJSONDownloadView(MaterialsAnalyticsDownloadMixin, generic.View):
+    export_label = 'STATISTICS'
+    export_extension = 'json'
+    content_type = 'application/json'
+
+    def write(self, response):
+        rating_matrix = self.materials.rating_matrix()
+        json.dump({
+            'materials': self.materials.title,
+            'conditions': rating_matrix.condition_statistics(),
+            'ratings': [
+                dict(zip(['participant', 'is_test_trial', 'item', 'condition', 'question', 'rating', 'z_score'], row))
+                for row in rating_matrix.z_score_rows()
+            ],
+        }, response)
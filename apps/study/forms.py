@@ -76,6 +76,8 @@ class StudySettingsForm(contrib_forms.CrispyModelForm):
             'pseudo_randomize_question_order',
             'use_vertical_scale_layout',
             'enable_item_rating_feedback',
+            'items_per_page',
+            'virtual_questionnaires',
         ]
         widgets = {
             'item_type': forms.RadioSelect(),
@@ -87,12 +89,15 @@ class StudySettingsForm(contrib_forms.CrispyModelForm):
         self.disable_itemtype = kwargs.pop('disable_itemtype', False)
         disable_question_order = kwargs.pop('disable_randomize_question_order', False)
         disable_use_blocks = kwargs.pop('disable_use_blocks', False)
+        disable_virtual_questionnaires = kwargs.pop('disable_virtual_questionnaires', False)
         disable_feedback = kwargs.pop('disable_feedback', False)
         super().__init__(*args, **kwargs)
         if disable_question_order:
             contrib_forms.disable_form_field(self, 'pseudo_randomize_question_order')
         if disable_use_blocks:
             contrib_forms.disable_form_field(self, 'use_blocks')
+        if disable_virtual_questionnaires:
+            contrib_forms.disable_form_field(self, 'virtual_questionnaires')
         if disable_feedback:
             contrib_forms.disable_form_field(self, 'enable_item_rating_feedback')
         if self.disable_itemtype:
@@ -122,6 +127,8 @@ class StudySettingsForm(contrib_forms.CrispyModelForm):
                     'use_blocks',
                     'pseudo_randomize_question_order',
                     'enable_item_rating_feedback',
+                    'items_per_page',
+                    'virtual_questionnaires',
                     HTML('<hr>'),
                 ),
             )
@@ -0,0 +1,185 @@
+import os
+import time
+import uuid
+from string import ascii_lowercase
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from apps.item import models as item_models
+from apps.materials import models as materials_models
+from apps.study import models as study_models
+from apps.trial import models as trial_models
+
+
+def scan_items_by_block_by_questionnaire(study, materials_list, questionnaires, lists_by_questionnaire, use_blocks):
+    # item assembly as done before the list->items index, kept as the baseline
+    items_by_block_by_questionnaire = {}
+    items = item_models.Item.objects.filter(materials__study=study).order_by('materials', 'number', 'condition')
+    items = list(items.prefetch_related('itemlist_set').all())
+    for questionnaire in questionnaires:
+        items_in_questionnaire = []
+        for item in items:
+            if set(item.itemlist_set.all()).intersection(lists_by_questionnaire[questionnaire]):
+                items_in_questionnaire.append(item)
+        items_by_block = {}
+        if use_blocks:
+            materials_block = {materials.pk: materials.auto_block for materials in materials_list}
+            for item in items_in_questionnaire:
+                block = materials_block[item.materials_id]
+                if block is None:
+                    block = item.block
+                items_by_block.setdefault(block, [])
+                items_by_block[block].append(item)
+        else:
+            items_by_block[1] = list(items_in_questionnaire)
+        items_by_block_by_questionnaire[questionnaire] = items_by_block
+    return items_by_block_by_questionnaire
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate questionnaires for synthetic studies of growing size. Reports the generation time per number of '
+        'generation processes and compares the item assembly with the item scan based baseline. Creates and deletes '
+        'data in the configured database.'
+    )
+
+    BENCHMARK_USER = 'lrex-benchmark'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', type=str, default='1,2,4,8', help='Comma separated numbers of experimental materials.',
+        )
+        parser.add_argument('--items', type=int, default=24, help='Items per materials.')
+        parser.add_argument(
+            '--conditions', type=str, default='2,3,4', help='Condition counts, cycled over the materials.',
+        )
+        parser.add_argument(
+            '--processes', type=str, default='1,{}'.format(os.cpu_count()),
+            help='Comma separated numbers of questionnaire generation processes.',
+        )
+
+    def _create_study(self, n_materials, n_items, condition_counts, randomization):
+        user, _ = User.objects.get_or_create(username=self.BENCHMARK_USER)
+        study = study_models.Study.objects.create(
+            title='Benchmark {}'.format(uuid.uuid4().hex[:8]),
+            creator=user,
+        )
+        question = study_models.Question.objects.create(study=study, number=0, question='How acceptable is it?')
+        study_models.ScaleValue.objects.bulk_create([
+            study_models.ScaleValue(question=question, number=i, label=str(i + 1)) for i in range(5)
+        ])
+        for i in range(n_materials + 1):
+            is_filler = i == n_materials
+            conditions = 'a' if is_filler else ascii_lowercase[:condition_counts[i % len(condition_counts)]]
+            materials = materials_models.Materials.objects.create(
+                study=study,
+                title='Filler' if is_filler else 'Exp{:03d}'.format(i),
+                is_filler=is_filler,
+            )
+            for number in range(1, n_items + 1):
+                for condition in conditions:
+                    item_models.TextItem.objects.create(
+                        materials=materials,
+                        number=number,
+                        condition=condition,
+                        text='{} sentence {}{}.'.format(materials.title, number, condition),
+                    )
+            materials.validate_items()
+        trial_models.QuestionnaireBlock.objects.create(
+            study=study, block=1, randomization=randomization,
+        )
+        return study_models.Study.objects.get(pk=study.pk)
+
+    def _assembly_input(self, study):
+        materials_list = list(study.materials.all())
+        materials_order = {materials.pk: i for i, materials in enumerate(materials_list)}
+        questionnaires = list(study.questionnaires.prefetch_related('item_lists'))
+        lists_by_questionnaire = {
+            questionnaire: sorted(
+                questionnaire.item_lists.all(), key=lambda item_list: materials_order[item_list.materials_id]
+            )
+            for questionnaire in questionnaires
+        }
+        return materials_list, questionnaires, lists_by_questionnaire
+
+    def _measure(self, assemble):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            items_by_block_by_questionnaire = assemble()
+            wall_time = time.perf_counter() - start
+        item_ids = [
+            (questionnaire.pk, block, [item.pk for item in items])
+            for questionnaire, items_by_block in items_by_block_by_questionnaire.items()
+            for block, items in items_by_block.items()
+        ]
+        return item_ids, len(queries), wall_time
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',')]
+            condition_counts = [int(count) for count in options['conditions'].split(',')]
+            process_counts = list(dict.fromkeys(int(count) for count in options['processes'].split(',')))
+        except ValueError:
+            raise CommandError('Sizes, conditions and processes must be comma separated numbers.')
+        self.stdout.write(
+            '{:>9} {:>14} {:>6} {} {} {:>22} {:>22} {:>10}'.format(
+                'materials', 'questionnaires', 'items',
+                ' '.join('{:>16}'.format('generation ms/{}p'.format(count)) for count in process_counts),
+                ' '.join('{:>18}'.format('randomization ms/{}p'.format(count)) for count in process_counts),
+                'baseline assembly ms', 'index assembly ms', 'identical',
+            )
+        )
+        for n_materials in sizes:
+            study = self._create_study(
+                n_materials, options['items'], condition_counts, trial_models.QuestionnaireBlock.RANDOMIZATION_PSEUDO,
+            )
+            try:
+                # generate once up front, so that every timed generation replaces the same questionnaires
+                study.generate_questionnaires()
+                generation_times = []
+                for count in process_counts:
+                    start = time.perf_counter()
+                    study.generate_questionnaires(processes=count)
+                    generation_times.append(time.perf_counter() - start)
+                study = study_models.Study.objects.get(pk=study.pk)
+                materials_list, questionnaires, lists_by_questionnaire = self._assembly_input(study)
+                items_by_block = study._items_by_block_by_questionnaire(
+                    materials_list, questionnaires, lists_by_questionnaire, study.use_blocks,
+                )
+                questions = list(study.questions.prefetch_related('scale_values'))
+                randomization_times = []
+                for count in process_counts:
+                    start = time.perf_counter()
+                    study._generate_questionnaire_orders(
+                        questionnaires, items_by_block, materials_list, questions, processes=count,
+                    )
+                    randomization_times.append(time.perf_counter() - start)
+                baseline_ids, baseline_queries, baseline_time = self._measure(
+                    lambda: scan_items_by_block_by_questionnaire(
+                        study, materials_list, questionnaires, lists_by_questionnaire, study.use_blocks,
+                    )
+                )
+                index_ids, index_queries, index_time = self._measure(
+                    lambda: study._items_by_block_by_questionnaire(
+                        materials_list, questionnaires, lists_by_questionnaire, study.use_blocks,
+                    )
+                )
+                self.stdout.write(
+                    '{:>9} {:>14} {:>6} {} {} {:>15.1f} ({:>3} q) {:>15.1f} ({:>3} q) {:>10}'.format(
+                        n_materials,
+                        len(questionnaires),
+                        sum(materials.items.count() for materials in materials_list),
+                        ' '.join('{:>16.1f}'.format(generation_time * 1000) for generation_time in generation_times),
+                        ' '.join('{:>18.1f}'.format(duration * 1000) for duration in randomization_times),
+                        baseline_time * 1000,
+                        baseline_queries,
+                        index_time * 1000,
+                        index_queries,
+                        'yes' if baseline_ids == index_ids else 'no',
+                    )
+                )
+            finally:
+                study.delete()
@@ -0,0 +1,101 @@
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from apps.study import models as study_models
+from apps.trial import models as trial_models
+
+
+def prefetch_results(materials):
+    # materials results as built before the values_list based results engine, kept as the baseline
+    ratings = trial_models.Rating.objects.filter(
+        questionnaire_item__item__materials=materials,
+    ).prefetch_related(
+        'scale_value',
+        'trial',
+        'trial__questionnaire',
+        'trial__questionnaire__study',
+        'questionnaire_item',
+        'questionnaire_item__item',
+        'questionnaire_item__item__textitem',
+        'questionnaire_item__item__audiolinkitem',
+        'questionnaire_item__item__markdownitem',
+        'questionnaire_item__question_properties',
+    )
+    has_question_with_random_scale = materials.study.has_question_with_random_scale
+    results = {}
+    for rating in ratings:
+        participant = rating.trial.number
+        item = rating.questionnaire_item.item
+        key = '{:03d}-{:03d}{}'.format(participant, item.number, item.condition)
+        if rating.trial.is_test:
+            key = 'test-' + key
+        if key in results:
+            row = results[key]
+            row['questions'].append(rating.question)
+            row['ratings'].append(rating.scale_value.number)
+            row['labels'].append(rating.scale_value.label)
+            row['comments'].append(rating.comment)
+        else:
+            row = {
+                'participant': participant,
+                'is_test_trial': 'yes' if rating.trial.is_test else 'no',
+                'item': item.number,
+                'condition': item.condition,
+                'position': rating.questionnaire_item.number + 1,
+                'content': item.content(materials.study),
+                'questions': [rating.question],
+                'ratings': [rating.scale_value.number],
+                'labels': [rating.scale_value.label],
+                'comments': [rating.comment],
+            }
+            if materials.study.pseudo_randomize_question_order:
+                row['question_order'] = rating.questionnaire_item.question_order_user
+            if has_question_with_random_scale:
+                row['random_scale'] = '\n'.join(
+                    q_property.question_scale_user
+                    for q_property in rating.questionnaire_item.question_properties.all()
+                )
+            results[key] = row
+    return [results[key] for key in sorted(results)]
+
+
+class Command(BaseCommand):
+    help = 'Compare query count, wall time and peak memory of the results engine with the prefetch based baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('study_slug', type=str)
+
+    def _measure(self, study, build):
+        study = study_models.Study.objects.get(pk=study.pk)
+        tracemalloc.start()
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            rows = build(study)
+            wall_time = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return rows, len(queries), wall_time, peak
+
+    def _write_measurement(self, name, queries, wall_time, peak):
+        self.stdout.write(
+            '{}: {} queries, {:.1f} ms, peak memory {:.1f} MiB'.format(name, queries, wall_time * 1000, peak / 2 ** 20)
+        )
+
+    def handle(self, *args, **options):
+        try:
+            study = study_models.Study.objects.get(slug=options['study_slug'])
+        except study_models.Study.DoesNotExist:
+            raise CommandError('Study does not exist.')
+        baseline_rows, *baseline = self._measure(
+            study,
+            lambda study: [row for materials in study.materials.all() for row in prefetch_results(materials)],
+        )
+        rows, *measurement = self._measure(study, lambda study: [row for _, row in study.results()])
+        self.stdout.write('result rows: {}'.format(len(rows)))
+        self._write_measurement('prefetch baseline', *baseline)
+        self._write_measurement('results engine', *measurement)
+        self.stdout.write('rows identical: {}'.format('yes' if rows == baseline_rows else 'no'))
@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.study import models as study_models
+
+
+class Command(BaseCommand):
+    help = 'Generate the questionnaires of a study, optionally randomized in a process pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument('study_slug', type=str)
+        parser.add_argument(
+            '--processes', type=int, default=settings.LREX_QUESTIONNAIRE_GENERATION_PROCESSES,
+            help='Randomization processes (default: LREX_QUESTIONNAIRE_GENERATION_PROCESSES).',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            study = study_models.Study.objects.get(slug=options['study_slug'])
+        except study_models.Study.DoesNotExist:
+            raise CommandError('Study does not exist.')
+        try:
+            study.generate_questionnaires(processes=options['processes'])
+        except RuntimeError as error:
+            raise CommandError('Pseudo-randomization failed. {}'.format(error))
+        self.stdout.write('Generated {} questionnaires.'.format(study.questionnaires.count()))
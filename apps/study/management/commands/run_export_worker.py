@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from apps.study import models as study_models
+
+
+class Command(BaseCommand):
+    help = 'Run pending export jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Exit when no pending job is left.')
+        parser.add_argument('--interval', type=float, default=2.0, help='Seconds to wait for new jobs.')
+
+    def _next_job(self):
+        return study_models.ExportJob.objects.filter(
+            status=study_models.ExportJob.STATUS_PENDING,
+        ).order_by('created').first()
+
+    def handle(self, *args, **options):
+        while True:
+            study_models.ExportJob.requeue_stale()
+            job = self._next_job()
+            if not job:
+                if options['once']:
+                    break
+                connection.close()
+                time.sleep(options['interval'])
+                continue
+            start = time.perf_counter()
+            if job.run():
+                job.refresh_from_db()
+                self.stdout.write('Finished {} export of "{}" ({} bytes, {:.1f} s).'.format(
+                    job.export_type, job.study.title, job.bytes_written, time.perf_counter() - start,
+                ))
+            elif study_models.ExportJob.objects.filter(pk=job.pk).exists():
+                job.refresh_from_db()
+                if job.status == study_models.ExportJob.STATUS_FAILED:
+                    self.stderr.write('Failed {} export of "{}": {}'.format(job.export_type, job.study.title, job.error))
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 00:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lrex_study', '0009_alter_study_slug'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='study',
+            name='version',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 01:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lrex_study', '0010_study_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='study',
+            name='items_per_page',
+            field=models.PositiveIntegerField(default=1, help_text='Number of items participants rate on one page. Set to 0 to show all items of a block on one page. A page never spans more than one block.'),
+        ),
+    ]
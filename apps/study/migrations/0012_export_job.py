@@ -0,0 +1,41 @@
+# Generated by Django 3.2.25 on 2026-10-18 01:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lrex_study', '0011_study_items_per_page'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('export_type', models.CharField(choices=[('results', 'Results (CSV)'), ('parquet', 'Results (Parquet)'), ('participants', 'Participant information (CSV)'), ('questionnaires', 'Questionnaires (CSV)'), ('archive', 'Archive (ZIP)')], max_length=20)),
+                ('version', models.CharField(max_length=40)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('finished', 'Finished'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('bytes_written', models.BigIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('updated', models.DateTimeField(default=django.utils.timezone.now)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('study', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='export_jobs', to='lrex_study.study')),
+            ],
+            options={
+                'ordering': ['-created'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='exportjob',
+            index=models.Index(fields=['status', 'created'], name='lrex_study__status_80e4f8_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='exportjob',
+            unique_together={('study', 'export_type', 'version')},
+        ),
+    ]
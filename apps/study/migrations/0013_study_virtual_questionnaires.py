@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 01:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lrex_study', '0012_export_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='study',
+            name='virtual_questionnaires',
+            field=models.BooleanField(default=False, help_text='Store only a random seed per questionnaire and derive its item order when it is assigned to the first participant. Speeds up the generation of many questionnaires.', verbose_name='Derive questionnaires on demand'),
+        ),
+    ]
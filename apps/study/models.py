@@ -1,15 +1,24 @@
 import csv
 import io
+import os
+import random
 import re
+import threading
 import zipfile
 from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import timedelta
+from functools import partial
 from itertools import groupby
+from operator import itemgetter
 from markdownx.models import MarkdownxField
 
 from enum import Enum
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import models
+from django.core.cache import cache
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import Count, F, Max, Q, Sum
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.functional import cached_property
@@ -19,8 +28,16 @@ from django.utils.timezone import now
 
 from apps.contrib import csv as contrib_csv
 from apps.contrib import math
+from apps.contrib.markdown import render_markdown_fields
+from apps.contrib.snapshots import ProgressFile, get_snapshot, snapshot_last_modified, snapshot_version
 from apps.contrib.utils import slugify_unique, split_list_string, strip_html_in_markdown_fields, to_list_string
 
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
 
 class StudySteps(Enum):
     STEP_STD_QUESTION_CREATE = 1
@@ -44,6 +61,46 @@ class StudySteps(Enum):
     STEP_STD_OPT_INVOICE = 19
 
 
+class ParticipationBundle:
+    """Questions, scales and item customizations of a study, as needed to build the rating forms."""
+
+    def __init__(self, questions, scale_values, item_questions, item_feedbacks, questionnaire_blocks):
+        self.questions = {question.number: question for question in questions}
+        self.scale_values = {}
+        for scale_value in scale_values:
+            self.scale_values.setdefault(scale_value.question_id, []).append(scale_value)
+        # parse the label lists once, before the bundle is cached
+        self.item_questions = {}
+        for item_question in item_questions:
+            item_question.scale_labels_list
+            self.item_questions[(item_question.item_id, item_question.number)] = item_question
+        self.item_feedbacks = {}
+        for item_feedback in item_feedbacks:
+            item_feedback.scale_values_list
+            self.item_feedbacks.setdefault(item_feedback.item_id, []).append(item_feedback)
+        self.questionnaire_blocks = {
+            questionnaire_block.block: questionnaire_block for questionnaire_block in questionnaire_blocks
+        }
+
+    def __len__(self):
+        return len(self.questions)
+
+    def question(self, number):
+        return self.questions[number]
+
+    def question_scale_values(self, question):
+        return self.scale_values.get(question.pk, [])
+
+    def item_question(self, item_id, number):
+        return self.item_questions.get((item_id, number))
+
+    def feedbacks(self, item_id):
+        return self.item_feedbacks.get(item_id, [])
+
+    def questionnaire_block(self, block):
+        return self.questionnaire_blocks.get(block)
+
+
 class Study(models.Model):
     title = models.CharField(
         max_length=100,
@@ -79,6 +136,12 @@ class Study(models.Model):
         default=False,
         help_text='Show questions in random order (if multiple questions are defined).',
     )
+    virtual_questionnaires = models.BooleanField(
+        default=False,
+        verbose_name='Derive questionnaires on demand',
+        help_text='Store only a random seed per questionnaire and derive its item order when it is assigned to the '
+                  'first participant. Speeds up the generation of many questionnaires.',
+    )
     use_vertical_scale_layout = models.BooleanField(
         default=False,
         help_text=(
@@ -90,6 +153,11 @@ class Study(models.Model):
         default=False,
         help_text='Allows you to define feedback shown to participants for individual item ratings.',
     )
+    items_per_page = models.PositiveIntegerField(
+        default=1,
+        help_text='Number of items participants rate on one page. Set to 0 to show all items of a block on one '
+                  'page. A page never spans more than one block.',
+    )
     password = models.CharField(
         blank=True,
         null=True,
@@ -296,6 +364,10 @@ class Study(models.Model):
     has_invoice = models.BooleanField(
         default=False,
     )
+    version = models.IntegerField(
+        default=0,
+        editable=False,
+    )
 
     class Meta:
         ordering = ['-created_date', 'title']
@@ -310,6 +382,7 @@ class Study(models.Model):
             self.slug = new_slug
             slug_changed = True
         super().save(*args, **kwargs)
+        render_markdown_fields(Study, self)
         if slug_changed:
             for materials in self.materials.all():
                 materials.save()
@@ -354,6 +427,35 @@ class Study(models.Model):
             if question.number == number:
                 return question
 
+    def bump_version(self):
+        Study.objects.filter(pk=self.pk).update(version=F('version') + 1)
+        self.refresh_from_db(fields=['version'])
+        self.__dict__.pop('participation_bundle', None)
+
+    PARTICIPATION_BUNDLE_CACHE_TIMEOUT = 24 * 60 * 60
+
+    @property
+    def participation_bundle_cache_key(self):
+        return 'lrex-participation-bundle-{}-{}'.format(self.pk, self.version)
+
+    def _compute_participation_bundle(self):
+        from apps.item.models import ItemFeedback, ItemQuestion
+        return ParticipationBundle(
+            questions=self.questions.all(),
+            scale_values=ScaleValue.objects.filter(question__study=self),
+            item_questions=ItemQuestion.objects.filter(item__materials__study=self),
+            item_feedbacks=ItemFeedback.objects.filter(item__materials__study=self),
+            questionnaire_blocks=self.questionnaire_blocks.all(),
+        )
+
+    @cached_property
+    def participation_bundle(self):
+        bundle = cache.get(self.participation_bundle_cache_key)
+        if bundle is None:
+            bundle = self._compute_participation_bundle()
+            cache.set(self.participation_bundle_cache_key, bundle, self.PARTICIPATION_BUNDLE_CACHE_TIMEOUT)
+        return bundle
+
     @cached_property
     def is_multi_question(self):
         return self.questions.count() > 1
@@ -433,26 +535,42 @@ class Study(models.Model):
         from apps.trial.models import Trial
         return Trial.objects.filter(questionnaire__study=self, is_test=True).count()
 
+    @property
+    def trials_active(self):
+        from apps.trial.models import Trial
+        return self.trials.filter(status=Trial.STATUS_ACTIVE, last_activity__gte=Trial.abandoned_before())
+
+    @property
+    def trials_abandoned(self):
+        from apps.trial.models import Trial
+        return self.trials.filter(status=Trial.STATUS_ACTIVE, last_activity__lt=Trial.abandoned_before())
+
     @cached_property
     def trial_count_active(self):
-        return len([trial for trial in self.trials if not trial.is_finished and not trial.is_abandoned])
+        return self.trials_active.count()
 
     @cached_property
     def trial_count_finished(self):
-        return len([trial for trial in self.trials if trial.is_finished])
+        from apps.trial.models import Trial
+        return self.trials.filter(status=Trial.STATUS_FINISHED).count()
 
     @cached_property
     def trial_count_abandoned(self):
-        return len([trial for trial in self.trials if trial.is_abandoned])
+        return self.trials_abandoned.count()
 
     def delete_abandoned_trials(self):
-        trials_abandoned = [trial for trial in self.trials if trial.is_abandoned]
-        for trial in trials_abandoned:
-            trial.delete()
+        self.trials_abandoned.delete()
+        self.update_questionnaire_trial_counts()
 
     def delete_test_trials(self):
         from apps.trial.models import Trial
         Trial.objects.filter(questionnaire__study=self, is_test=True).delete()
+        self.update_questionnaire_trial_counts()
+
+    def delete_trials(self):
+        from apps.trial.models import Trial
+        Trial.objects.filter(questionnaire__study=self).delete()
+        self.update_questionnaire_trial_counts()
 
     @property
     def has_participant_information(self):
@@ -524,26 +642,42 @@ class Study(models.Model):
     def questionnaire_length(self):
         first_questionnaire = self.questionnaires.first()
         if first_questionnaire:
+            if not first_questionnaire.materialized:
+                return sum(item_list.items.count() for item_list in first_questionnaire.item_lists.all())
             return first_questionnaire.questionnaire_items.count()
         return 0
 
-    def _questionnaire_trial_count(self, is_test=False):
+    def next_trial_number(self, is_test=False):
+        """Must be called inside the transaction that saves the new trial."""
         from apps.trial.models import Trial
-        questionnaires = self.questionnaires.all()
-        trials = Trial.objects.filter(
-            questionnaire_id__in=[questionnaire.id for questionnaire in questionnaires],
-            is_test=is_test,
-        ).order_by('questionnaire_id')
-        trials_per_questionnaire = groupby(trials, lambda x: x.questionnaire_id)
-        trial_count_by_id = {q_id: len(list(q_trials)) for q_id, q_trials in trials_per_questionnaire}
-        trial_count = {}
+        list(Study.objects.select_for_update().filter(pk=self.pk).values_list('pk', flat=True))
+        last_number = Trial.objects.filter(
+            questionnaire__study=self, is_test=is_test,
+        ).aggregate(Max('number'))['number__max']
+        return (last_number or 0) + 1
+
+    def update_questionnaire_trial_counts(self):
+        from apps.trial.models import Questionnaire
+        questionnaires = self.questionnaires.annotate(
+            n_trials=Count('trial', filter=Q(trial__is_test=False)),
+            n_test_trials=Count('trial', filter=Q(trial__is_test=True)),
+        )
         for questionnaire in questionnaires:
-            trial_count.update({questionnaire: trial_count_by_id.get(questionnaire.id, 0)})
-        return trial_count
+            questionnaire.trial_count = questionnaire.n_trials
+            questionnaire.test_trial_count = questionnaire.n_test_trials
+        Questionnaire.objects.bulk_update(questionnaires, ['trial_count', 'test_trial_count'])
 
     def next_questionnaire(self, is_test=False):
-        trial_count = self._questionnaire_trial_count(is_test)
-        next_questionnaire = min(trial_count, key=trial_count.get)
+        from apps.trial.models import Questionnaire
+        count_field = 'test_trial_count' if is_test else 'trial_count'
+        questionnaires = self.questionnaires.order_by(count_field, 'number')
+        with transaction.atomic():
+            next_questionnaire = None
+            if connection.features.has_select_for_update_skip_locked:
+                next_questionnaire = questionnaires.select_for_update(skip_locked=True).first()
+            if not next_questionnaire:
+                next_questionnaire = questionnaires.select_for_update().first()
+            Questionnaire.objects.filter(pk=next_questionnaire.pk).update(**{count_field: F(count_field) + 1})
         return next_questionnaire
 
     def _questionnaire_count(self, materials_list):
@@ -611,19 +745,36 @@ class Study(models.Model):
                     questionnaire_permutations.append(Questionnaire(study=self, number=num, slug=slug))
         return questionnaire_permutations
 
-    def _items_by_block_by_questionnaire(self, materials_list, questionnaires, lists_by_questionnaire, use_blocks):
-        from apps.item.models import Item
+    def _items_by_list(self, item_lists=None):
+        from apps.item.models import Item, ItemList
+        items = Item.objects.filter(materials__study=self)
+        list_items = ItemList.items.through.objects.filter(itemlist__materials__study=self)
+        if item_lists is not None:
+            items = items.filter(itemlist__in=item_lists)
+            list_items = list_items.filter(itemlist__in=item_lists)
+        items = items.in_bulk()
+        items_by_list = {}
+        list_items = list_items.order_by('itemlist_id', 'item__number', 'item__condition').values_list(
+            'itemlist_id', 'item_id',
+        )
+        for item_list_id, item_id in list_items:
+            items_by_list.setdefault(item_list_id, []).append(items[item_id])
+        return items_by_list
+
+    def _items_by_block_by_questionnaire(
+            self, materials_list, questionnaires, lists_by_questionnaire, use_blocks, item_lists=None,
+    ):
         items_by_block_by_questionnaire = {}
-        items = Item.objects.filter(materials__study=self).order_by('materials', 'number', 'condition')
-        items = list(items.prefetch_related('itemlist_set').all())
+        items_by_list = self._items_by_list(item_lists)
+        materials_block = {materials.pk: materials.auto_block for materials in materials_list}
         for questionnaire in questionnaires:
-            items_in_questionnaire = []
-            for item in items:
-                if set(item.itemlist_set.all()).intersection(lists_by_questionnaire[questionnaire]):
-                    items_in_questionnaire.append(item)
+            items_in_questionnaire = [
+                item
+                for item_list in lists_by_questionnaire[questionnaire]
+                for item in items_by_list.get(item_list.pk, [])
+            ]
             items_by_block = {}
             if use_blocks:
-                materials_block = {materials.pk: materials.auto_block for materials in materials_list}
                 for item in items_in_questionnaire:
                     block = materials_block[item.materials_id]
                     if block is None:
@@ -631,19 +782,124 @@ class Study(models.Model):
                     items_by_block.setdefault(block, [])
                     items_by_block[block].append(item)
             else:
-                items_by_block[1] = list(items_in_questionnaire)
+                items_by_block[1] = items_in_questionnaire
             items_by_block_by_questionnaire[questionnaire] = items_by_block
         return items_by_block_by_questionnaire
 
-    def generate_questionnaires(self):
+    def _randomization_materials(self, materials_list):
+        from apps.trial import randomization
+        return {
+            materials.pk: randomization.Materials(materials.title, materials.is_filler, materials.condition_count)
+            for materials in materials_list
+        }
+
+    def _randomization_items_by_block(self, items_by_block):
+        from apps.trial import randomization
+        return {
+            block: [randomization.Item(item.pk, item.materials_id, item.condition) for item in block_items]
+            for block, block_items in items_by_block.items()
+        }
+
+    def _generate_questionnaire_orders(self, questionnaires, items_by_block, materials_list, questions, processes=1):
+        from apps.trial import randomization
+        generate = partial(
+            randomization.generate_questionnaire,
+            materials_dict=self._randomization_materials(materials_list),
+            questions=[
+                randomization.Question(question.number, len(question.scale_values.all()), question.randomize_scale)
+                for question in questions
+            ],
+            randomize_question_order=self.pseudo_randomize_question_order,
+            randomize_scales=self.has_question_with_random_scale,
+        )
+        numbers = [questionnaire.number for questionnaire in questionnaires]
+        items_by_block = [
+            self._randomization_items_by_block(items_by_block[questionnaire]) for questionnaire in questionnaires
+        ]
+        block_randomizations = [
+            questionnaire.block_randomization_dict or self.block_randomization for questionnaire in questionnaires
+        ]
+        seeds = [questionnaire.seed for questionnaire in questionnaires]
+        if min(processes, len(questionnaires)) < 2:
+            return list(map(generate, numbers, items_by_block, block_randomizations, seeds))
+        # questionnaires without a seed draw from their own random.Random, seeded from the OS
+        chunk_size = max(1, len(questionnaires) // (processes * 4))
+        return list(_generation_executor(processes).map(
+            generate, numbers, items_by_block, block_randomizations, seeds, chunksize=chunk_size,
+        ))
+
+    def save_generated_questionnaires(self, questionnaires, generated_questionnaires):
         from apps.trial.models import Questionnaire, QuestionnaireItem, QuestionProperty
+        questionnaires_by_number = {questionnaire.number: questionnaire for questionnaire in questionnaires}
+        questionnaire_items = []
+        scale_orders = []
+        for generated in generated_questionnaires:
+            questionnaire = questionnaires_by_number[generated.number]
+            questionnaire.set_block_offsets(generated.item_blocks)
+            items = [
+                QuestionnaireItem(
+                    number=i,
+                    questionnaire=questionnaire,
+                    item_id=item_id,
+                    question_order=question_order,
+                )
+                for i, (item_id, question_order) in enumerate(zip(generated.item_ids, generated.question_orders))
+            ]
+            questionnaire_items.extend(items)
+            scale_orders.extend(
+                (items[i], number, scale_order) for i, number, scale_order in generated.scale_orders
+            )
+        QuestionnaireItem.objects.bulk_create(questionnaire_items)
+        Questionnaire.objects.bulk_update(questionnaires, ['block_offsets'])
+        QuestionProperty.objects.bulk_create([
+            QuestionProperty(number=number, questionnaire_item=questionnaire_item, scale_order=scale_order)
+            for questionnaire_item, number, scale_order in scale_orders
+        ])
+
+    def derive_questionnaires(self, questionnaires):
+        """Item orders of virtual questionnaires, derived from their seeds."""
+        materials_list = list(self.materials.all())
+        materials_order = {materials.pk: i for i, materials in enumerate(materials_list)}
+        lists_by_questionnaire = {
+            questionnaire: sorted(
+                questionnaire.item_lists.all(), key=lambda item_list: materials_order[item_list.materials_id]
+            )
+            for questionnaire in questionnaires
+        }
+        items_by_block = self._items_by_block_by_questionnaire(
+            materials_list, questionnaires, lists_by_questionnaire, self.use_blocks,
+            item_lists=[item_list for item_lists in lists_by_questionnaire.values() for item_list in item_lists],
+        )
+        questions = list(self.questions.prefetch_related('scale_values'))
+        return self._generate_questionnaire_orders(questionnaires, items_by_block, materials_list, questions)
+
+    def _init_virtual_questionnaires(self, questionnaires, items_by_block, materials_list):
+        from apps.trial import randomization
+        from apps.trial.models import Questionnaire
+        materials_dict = self._randomization_materials(materials_list)
+        block_randomization = self.block_randomization
+        seed_random = random.SystemRandom()
+        for questionnaire in questionnaires:
+            randomization.check_questionnaire(
+                questionnaire.number,
+                self._randomization_items_by_block(items_by_block[questionnaire]),
+                block_randomization,
+                materials_dict,
+            )
+            questionnaire.seed = seed_random.getrandbits(63)
+            questionnaire.set_block_randomization(block_randomization)
+            questionnaire.materialized = False
+        Questionnaire.objects.bulk_update(questionnaires, ['seed', 'block_randomization', 'materialized'])
+
+    def generate_questionnaires(self, processes=1):
+        """Processes above 1 randomize in a process pool, meant for the generate_questionnaires command only."""
+        from apps.trial.models import Questionnaire
         try:
             self.questionnaires.all().delete()
             materials_list = list(self.materials.prefetch_related('items', 'lists').all())
             item_lists_by_materials = self._get_item_lists_by_materials(materials_list)
             questionnaires = self._initial_questionnaires(materials_list)
-            randomize_scales = self.has_question_with_random_scale
-            questions = list(self.questions.all())
+            questions = list(self.questions.prefetch_related('scale_values'))
             if self.randomization_reqiured:
                 questionnaires.extend(self._generate_questionnaire_permutations(materials_list, questionnaires))
             questionnaires = Questionnaire.objects.bulk_create(questionnaires)
@@ -653,24 +909,15 @@ class Study(models.Model):
             items_by_block = self._items_by_block_by_questionnaire(
                 materials_list, questionnaires, lists_by_questionnaire, self.use_blocks
             )
-            all_questionnaires = []
-            questionnaire_items_by_questionnaire = {}
-            for questionnaire in questionnaires:
-                questionnaire_items = questionnaire.generate_questionnaire_items(
-                    self, materials_list, items_by_block[questionnaire], self.block_randomization
+            if self.virtual_questionnaires:
+                self._init_virtual_questionnaires(questionnaires, items_by_block, materials_list)
+            else:
+                self.save_generated_questionnaires(
+                    questionnaires,
+                    self._generate_questionnaire_orders(
+                        questionnaires, items_by_block, materials_list, questions, processes,
+                    ),
                 )
-                if self.pseudo_randomize_question_order:
-                    questionnaire.randomize_question_order(questions, questionnaire_items)
-                questionnaire_items_by_questionnaire[questionnaire] = questionnaire_items
-                all_questionnaires.extend(questionnaire_items)
-            QuestionnaireItem.objects.bulk_create(all_questionnaires)
-            question_properties = []
-            for questionnaire, questionnaire_items in questionnaire_items_by_questionnaire.items():
-                if randomize_scales:
-                    question_properties.extend(
-                        questionnaire.generate_question_properties(questions, questionnaire_items)
-                    )
-            QuestionProperty.objects.bulk_create(question_properties)
         except RuntimeError as error:
             self.delete_questionnaires()
             raise error
@@ -682,6 +929,7 @@ class Study(models.Model):
 
     def delete_questionnaire_blocks(self):
         self.questionnaire_blocks.all().delete()
+        self.bump_version()
 
     @cached_property
     def contact(self):
@@ -693,27 +941,39 @@ class Study(models.Model):
         )
 
     def participant_information_csv(self, fileobj):
-        from apps.trial.models import Trial
+        from apps.trial.models import DemographicValue, Trial
         writer = csv.writer(fileobj, delimiter=contrib_csv.DEFAULT_DELIMITER, quoting=contrib_csv.DEFAULT_QUOTING)
+        demographic_columns = {
+            field_id: column for column, field_id in enumerate(self.demographics.values_list('pk', flat=True))
+        }
         csv_row = ['participant', 'id', 'trial start utc', 'trial end utc', 'time taken sec']
-        if self.has_demographics:
-            csv_row.extend(
-                'demographic{}'.format(i) for i, demographic_field in enumerate(self.demographics.all(), 1)
-            )
+        csv_row.extend('demographic{}'.format(column) for column in range(1, len(demographic_columns) + 1))
         writer.writerow(csv_row)
-        trials = Trial.objects.filter(questionnaire__study=self, is_test=False)
-        if self.has_demographics:
-            trials = trials.prefetch_related('demographics')
-        for i, trial in enumerate(trials, 1):
+        trials = Trial.objects.filter(questionnaire__study=self, is_test=False).order_by('created', 'pk').values_list(
+            'pk', 'participant_id', 'created', 'ended',
+        )
+        demographic_values = DemographicValue.objects.filter(
+            trial__questionnaire__study=self, trial__is_test=False,
+        ).order_by('trial__created', 'trial_id').values_list('trial_id', 'field_id', 'value').iterator(
+            chunk_size=self.RESULTS_CHUNK_SIZE,
+        )
+        demographic_value = next(demographic_values, None)
+        for i, (trial_id, participant_id, created, ended) in enumerate(
+            trials.iterator(chunk_size=self.RESULTS_CHUNK_SIZE), 1
+        ):
             csv_row = [
                 i,
-                trial.participant_id,
-                format(trial.created, 'Y-m-d H:i:s') if trial.created else '',
-                format(trial.ended, 'Y-m-d H:i:s') if trial.ended else '',
-                trial.time_taken,
+                participant_id,
+                created.strftime('%Y-%m-%d %H:%M:%S') if created else '',
+                ended.strftime('%Y-%m-%d %H:%M:%S') if ended else '',
+                (ended - created).seconds if ended else None,
             ]
-            if self.has_demographics:
-                csv_row.extend(demographic_value.value for demographic_value in trial.demographics.all())
+            if demographic_columns:
+                demographics = [''] * len(demographic_columns)
+                while demographic_value and demographic_value[0] == trial_id:
+                    demographics[demographic_columns[demographic_value[1]]] = demographic_value[2]
+                    demographic_value = next(demographic_values, None)
+                csv_row.extend(demographics)
             writer.writerow(csv_row)
 
     @property
@@ -739,12 +999,42 @@ class Study(models.Model):
              'Questionnaire blocks (if used)'),
         ]
 
+    @property
+    def EXPORT_FILES(self):
+        return {
+            ExportJob.EXPORT_RESULTS: (
+                self.results_data_version, self.results_csv, False, 'text/csv', 'RESULTS.csv', '%Y-%m-%d-%H%M',
+            ),
+            ExportJob.EXPORT_RESULTS_PARQUET: (
+                self.results_data_version, self.results_parquet, True, 'application/vnd.apache.parquet',
+                'RESULTS.parquet', '%Y-%m-%d-%H%M',
+            ),
+            ExportJob.EXPORT_PARTICIPANTS: (
+                self.results_data_version, self.participant_information_csv, False, 'text/csv', 'PARTICIPANTS.csv',
+                '%Y-%m-%d-%H%M',
+            ),
+            ExportJob.EXPORT_QUESTIONNAIRES: (
+                self.questionnaires_data_version, self.questionnaires_csv, False, 'text/csv', 'QUESTIONNAIRES.csv',
+                '%Y-%m-%d',
+            ),
+            ExportJob.EXPORT_ARCHIVE: (
+                self.archive_data_version, self.archive_file, True, 'application/zip', 'ARCHIVE.zip', '%Y-%m-%d',
+            ),
+        }
+
+    def export_filename(self, export_type):
+        _, _, _, _, filename, date_format = self.EXPORT_FILES[export_type]
+        label, extension = filename.split('.')
+        return '{}_{}_{}.{}'.format(self.title.replace(' ', '_'), label, now().strftime(date_format), extension)
+
     SETTING_FIELDS = [
         'title',
         'item_type',
         'use_blocks',
         'pseudo_randomize_question_order',
+        'virtual_questionnaires',
         'enable_item_rating_feedback',
+        'items_per_page',
         'password',
         'participant_id',
         'end_date',
@@ -774,6 +1064,7 @@ class Study(models.Model):
     SETTING_BOOL_FIELDS = [
         'use_blocks',
         'pseudo_randomize_question_order',
+        'virtual_questionnaires',
     ]
 
     def _read_settings(self, reader):
@@ -783,13 +1074,205 @@ class Study(models.Model):
                 study_settings.update({row[0]: row[1]})
         return study_settings
 
+    RESULTS_CHUNK_SIZE = 2000
+
+    def _results_item_contents(self, materials=None):
+        from apps.item.models import Item
+        if self.has_text_items:
+            content_field = 'textitem__text'
+        elif self.has_markdown_items:
+            content_field = 'markdownitem__text'
+        elif self.has_audiolink_items:
+            content_field = 'audiolinkitem__urls'
+        else:
+            return {}
+        items = Item.objects.filter(materials__study=self)
+        if materials:
+            items = items.filter(materials=materials)
+        return dict(items.values_list('pk', content_field))
+
+    def _results_random_scales(self, materials=None):
+        from apps.trial.models import QuestionProperty
+        bundle = self.participation_bundle
+        question_properties = QuestionProperty.objects.filter(questionnaire_item__questionnaire__study=self)
+        if materials:
+            question_properties = question_properties.filter(questionnaire_item__item__materials=materials)
+        question_properties = question_properties.order_by(
+            'questionnaire_item_id', 'number'
+        ).values_list('questionnaire_item_id', 'number', 'scale_order')
+        random_scales = {}
+        for questionnaire_item_id, question_number, scale_order in question_properties.iterator():
+            scale_values = bundle.question_scale_values(bundle.question(question_number))
+            random_scales.setdefault(questionnaire_item_id, []).append(
+                ','.join(scale_values[int(pos)].label for pos in scale_order.split(','))
+            )
+        return {key: '\n'.join(scales) for key, scales in random_scales.items()}
+
+    def _results_scale_values(self):
+        bundle = self.participation_bundle
+        return {
+            scale_value.pk: scale_value
+            for question in bundle.questions.values() for scale_value in bundle.question_scale_values(question)
+        }
+
+    @staticmethod
+    def _results_question_order(question_order, question_orders):
+        if question_order not in question_orders:
+            question_orders[question_order] = ','.join(
+                str(int(question_num) + 1) for question_num in question_order.split(',')
+            )
+        return question_orders[question_order]
+
+    def _results_ratings(self, materials=None):
+        from apps.trial.models import Rating
+        ratings = Rating.objects.filter(questionnaire_item__item__materials__study=self)
+        if materials:
+            ratings = ratings.filter(questionnaire_item__item__materials=materials)
+        return ratings.order_by(
+            'questionnaire_item__item__materials__title', 'questionnaire_item__item__materials_id',
+            'trial__is_test', 'trial__number', 'trial_id', 'questionnaire_item__item__number',
+            'questionnaire_item__item__condition', 'questionnaire_item_id', 'question',
+        ).values_list(
+            'trial_id', 'questionnaire_item_id', 'questionnaire_item__item__materials_id', 'trial__number',
+            'trial__is_test', 'questionnaire_item__item_id', 'questionnaire_item__item__number',
+            'questionnaire_item__item__condition', 'questionnaire_item__number', 'questionnaire_item__question_order',
+            'question', 'scale_value_id', 'comment',
+        ).iterator(chunk_size=self.RESULTS_CHUNK_SIZE)
+
+    def results(self, materials=None):
+        """Yields (materials id, result row) pairs, ordered by materials, participant, item and condition."""
+        scale_values = self._results_scale_values()
+        item_contents = self._results_item_contents(materials)
+        random_scales = self._results_random_scales(materials) if self.has_question_with_random_scale else None
+        question_orders = {}
+        for _, group in groupby(self._results_ratings(materials), itemgetter(0, 1)):
+            group = list(group)
+            (
+                _, questionnaire_item_id, materials_id, participant, is_test, item_id, item_number, condition,
+                position, question_order, _, _, _,
+            ) = group[0]
+            row = {
+                'participant': participant,
+                'is_test_trial': 'yes' if is_test else 'no',
+                'item': item_number,
+                'condition': condition,
+                'position': position + 1,
+                'content': item_contents.get(item_id, ''),
+                'questions': [rating[10] for rating in group],
+                'ratings': [scale_values[rating[11]].number for rating in group],
+                'labels': [scale_values[rating[11]].label for rating in group],
+                'comments': [rating[12] for rating in group],
+            }
+            if self.pseudo_randomize_question_order:
+                row['question_order'] = self._results_question_order(question_order, question_orders)
+            if random_scales is not None:
+                row['random_scale'] = random_scales.get(questionnaire_item_id, '')
+            yield materials_id, row
+
+    RESULTS_PARQUET_ROW_GROUP_SIZE = 100000
+
+    @property
+    def has_parquet_support(self):
+        return pyarrow is not None
+
+    def _results_parquet_schema(self):
+        category = pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+        fields = [
+            ('materials', category),
+            ('participant', pyarrow.int32()),
+            ('is_test_trial', pyarrow.bool_()),
+            ('item', pyarrow.int32()),
+            ('condition', category),
+            ('position', pyarrow.int32()),
+            ('question', pyarrow.int16()),
+            ('rating', category),
+            ('rating_number', pyarrow.int16()),
+            ('comment', pyarrow.string()),
+        ]
+        if self.pseudo_randomize_question_order:
+            fields.append(('question_order', category))
+        if self.has_question_with_random_scale:
+            fields.append(('random_scale', category))
+        fields.append(('content', category))
+        return pyarrow.schema(fields)
+
+    def _results_parquet_table(self, schema, columns):
+        arrays = []
+        for field in schema:
+            if pyarrow.types.is_dictionary(field.type):
+                arrays.append(pyarrow.array(columns[field.name], type=pyarrow.string()).dictionary_encode())
+            else:
+                arrays.append(pyarrow.array(columns[field.name], type=field.type))
+        return pyarrow.Table.from_arrays(arrays, schema=schema)
+
+    def results_parquet(self, fileobj):
+        """Writes one row per rating, in row groups of RESULTS_PARQUET_ROW_GROUP_SIZE ratings."""
+        scale_values = self._results_scale_values()
+        item_contents = self._results_item_contents()
+        random_scales = self._results_random_scales() if self.has_question_with_random_scale else None
+        materials_titles = dict(self.materials.values_list('pk', 'title'))
+        question_orders = {}
+        schema = self._results_parquet_schema()
+        columns = {name: [] for name in schema.names}
+        with pyarrow.parquet.ParquetWriter(fileobj, schema) as writer:
+            for (
+                _, questionnaire_item_id, materials_id, participant, is_test, item_id, item_number, condition,
+                position, question_order, question, scale_value_id, comment,
+            ) in self._results_ratings():
+                scale_value = scale_values[scale_value_id]
+                columns['materials'].append(materials_titles[materials_id])
+                columns['participant'].append(participant)
+                columns['is_test_trial'].append(is_test)
+                columns['item'].append(item_number)
+                columns['condition'].append(condition)
+                columns['position'].append(position + 1)
+                columns['question'].append(question + 1)
+                columns['rating'].append(scale_value.label)
+                columns['rating_number'].append(scale_value.number)
+                columns['comment'].append(comment)
+                if self.pseudo_randomize_question_order:
+                    columns['question_order'].append(self._results_question_order(question_order, question_orders))
+                if random_scales is not None:
+                    columns['random_scale'].append(random_scales.get(questionnaire_item_id, ''))
+                columns['content'].append(item_contents.get(item_id, ''))
+                if len(columns['participant']) == self.RESULTS_PARQUET_ROW_GROUP_SIZE:
+                    writer.write_table(self._results_parquet_table(schema, columns))
+                    columns = {name: [] for name in schema.names}
+            if columns['participant']:
+                writer.write_table(self._results_parquet_table(schema, columns))
+
+    def results_data_version(self):
+        """Fingerprint of the trials, participant information and settings that results exports are built from."""
+        from apps.trial.models import DemographicValue, Trial
+        trials = Trial.objects.filter(questionnaire__study=self).aggregate(
+            count=Count('pk'),
+            ratings_completed=Sum('ratings_completed'),
+            participant_ids=Count('participant_id'),
+            created=Max('created'),
+            last_activity=Max('last_activity'),
+            ended=Max('ended'),
+        )
+        return snapshot_version(
+            self.version,
+            [getattr(self, setting_field) for setting_field in self.SETTING_FIELDS],
+            self.demographics_string,
+            list(self.materials.values_list()),
+            self._items_data_version(),
+            trials,
+            DemographicValue.objects.filter(trial__questionnaire__study=self).count(),
+        )
+
+    def results_csv_rows(self):
+        materials_by_id = OrderedDict((materials.pk, materials) for materials in self.materials.all())
+        if not materials_by_id:
+            return
+        yield next(iter(materials_by_id.values())).results_csv_header()
+        for materials_id, result in self.results():
+            yield materials_by_id[materials_id].results_csv_row(result)
+
     def results_csv(self, fileobj):
-        for i, materials in enumerate(self.materials.all()):
-            if i == 0:
-                writer = csv.writer(fileobj, delimiter=contrib_csv.DEFAULT_DELIMITER, quoting=contrib_csv.DEFAULT_QUOTING)
-                header = materials.results_csv_header()
-                writer.writerow(header)
-            materials.results_csv(fileobj)
+        writer = csv.writer(fileobj, delimiter=contrib_csv.DEFAULT_DELIMITER, quoting=contrib_csv.DEFAULT_QUOTING)
+        writer.writerows(self.results_csv_rows())
 
     def settings_csv(self, fileobj):
         writer = csv.writer(fileobj, delimiter=contrib_csv.DEFAULT_DELIMITER, quoting=contrib_csv.DEFAULT_QUOTING)
@@ -870,6 +1353,7 @@ class Study(models.Model):
                 )
             question_number += 1
         ScaleValue.objects.bulk_create(scale_values)
+        self.bump_version()
 
     def materials_csv_header(self, **kwargs):
         return ['title', 'list_distribution', 'is_filler', 'is_example', 'block', 'items_validated']
@@ -935,24 +1419,69 @@ class Study(models.Model):
     def questionnaires_csv_header(self, **kwargs):
         return ['questionnaire', 'lists', 'items', 'question_order']
 
+    QUESTIONNAIRE_DERIVE_CHUNK_SIZE = 100
+
     def questionnaires_csv(self, fileobj):
+        from apps.item.models import Item
+        from apps.trial.models import Questionnaire, QuestionnaireItem
         writer = csv.writer(fileobj, delimiter=contrib_csv.DEFAULT_DELIMITER, quoting=contrib_csv.DEFAULT_QUOTING)
         header = self.questionnaires_csv_header()
         writer.writerow(header)
-        for questionnaire in self.questionnaires.all():
-            csv_row = [
-                questionnaire.number,
-                ','.join(['{}-{}'.format(item_list.materials.title, item_list.number)
-                          for item_list in questionnaire.item_lists.all()]),
-                ','.join(['{}-{}'.format(item.materials.title, item) for item in questionnaire.items]),
-            ]
-            if self.pseudo_randomize_question_order:
-                csv_row.append(
-                    ','.join('"{}"'.format(q_item.question_order) for q_item in questionnaire.questionnaire_items.all())
-                )
-            else:
-                csv_row.append('')
-            writer.writerow(csv_row)
+        questionnaire_lists = {}
+        item_lists = Questionnaire.item_lists.through.objects.filter(
+            questionnaire__study=self,
+        ).order_by('questionnaire_id', 'itemlist').values_list(
+            'questionnaire_id', 'itemlist__materials__title', 'itemlist__number',
+        )
+        for questionnaire_id, materials_title, list_number in item_lists:
+            questionnaire_lists.setdefault(questionnaire_id, []).append('{}-{}'.format(materials_title, list_number))
+        virtual_questionnaires = list(
+            self.questionnaires.filter(materialized=False).order_by('number', 'pk').prefetch_related('item_lists')
+        )
+        virtual_positions = {questionnaire.pk: i for i, questionnaire in enumerate(virtual_questionnaires)}
+        derived_questionnaires = {}
+        item_labels = {}
+        if virtual_questionnaires:
+            item_labels = {
+                item_id: '{}-{}{}'.format(materials_title, item_number, item_condition)
+                for item_id, materials_title, item_number, item_condition in Item.objects.filter(
+                    materials__study=self,
+                ).values_list('pk', 'materials__title', 'number', 'condition')
+            }
+        questionnaire_items = QuestionnaireItem.objects.filter(
+            questionnaire__study=self,
+        ).order_by('questionnaire__number', 'questionnaire_id', 'number').values_list(
+            'questionnaire_id', 'item__materials__title', 'item__number', 'item__condition', 'question_order',
+        )
+        items_by_questionnaire = groupby(questionnaire_items.iterator(chunk_size=2000), key=itemgetter(0))
+        next_items = next(items_by_questionnaire, None)
+        for questionnaire_id, questionnaire_number in self.questionnaires.order_by('number', 'pk').values_list(
+            'pk', 'number',
+        ):
+            items = []
+            question_orders = []
+            if questionnaire_id in virtual_positions:
+                # derive the not yet stored questionnaires a chunk at a time
+                if questionnaire_id not in derived_questionnaires:
+                    position = virtual_positions[questionnaire_id]
+                    chunk = virtual_questionnaires[position:position + self.QUESTIONNAIRE_DERIVE_CHUNK_SIZE]
+                    derived_questionnaires = dict(zip(
+                        [questionnaire.pk for questionnaire in chunk], self.derive_questionnaires(chunk),
+                    ))
+                derived = derived_questionnaires[questionnaire_id]
+                items = [item_labels[item_id] for item_id in derived.item_ids]
+                question_orders = ['"{}"'.format(question_order) for question_order in derived.question_orders]
+            elif next_items and next_items[0] == questionnaire_id:
+                for _, materials_title, item_number, item_condition, question_order in next_items[1]:
+                    items.append('{}-{}{}'.format(materials_title, item_number, item_condition))
+                    question_orders.append('"{}"'.format(question_order))
+                next_items = next(items_by_questionnaire, None)
+            writer.writerow([
+                questionnaire_number,
+                ','.join(questionnaire_lists.get(questionnaire_id, [])),
+                ','.join(items),
+                ','.join(question_orders) if self.pseudo_randomize_question_order else '',
+            ])
 
     def questionnaires_from_csv(self, fileobj, user_columns=None, detected_csv=contrib_csv.DEFAULT_DIALECT):
         # FIXME: handle validation error?
@@ -968,6 +1497,8 @@ class Study(models.Model):
         materials_titles = { materials.pk: materials.title for materials in self.materials.all()}
         study_items = list(Item.objects.filter(materials__study=self).all())
         study_itemlists = list(ItemList.objects.filter(materials__study=self).all())
+        materials_blocks = {materials.pk: materials.auto_block for materials in self.materials.all()}
+        questionnaires = []
         for row in reader:
             if not row:
                 continue
@@ -978,6 +1509,14 @@ class Study(models.Model):
                 )
                 questionnaire.item_lists.set(item_lists)
             items = QuestionnaireUploadForm.read_items(row[columns['items']], materials_titles, study_items)
+            item_blocks = [1] * len(items)
+            if self.use_blocks:
+                item_blocks = [
+                    item.block if materials_blocks[item.materials_id] is None else materials_blocks[item.materials_id]
+                    for item in items
+                ]
+            questionnaire.set_block_offsets(item_blocks)
+            questionnaires.append(questionnaire)
             if self.pseudo_randomize_question_order:
                 question_orders = re.findall('"([^"]+)"', row[columns['question_order']])  # FIXME: why
             for i, item in enumerate(items):
@@ -990,6 +1529,7 @@ class Study(models.Model):
                     )
                 )
         QuestionnaireItem.objects.bulk_create(questionnaire_items)
+        Questionnaire.objects.bulk_update(questionnaires, ['block_offsets'])
 
     def questionnaire_blocks_csv_header(self, **kwargs):
         return ['block', 'randomization', 'instructions', 'short_instructions']
@@ -1038,15 +1578,65 @@ class Study(models.Model):
             fileobj.seek(0)
             materials.item_feedbacks_from_csv(fileobj, has_materials_column=True)
 
+    def _items_data_version(self):
+        # item saves update the timestamp, deletions the count and new items the largest pk
+        from apps.item.models import Item
+        return Item.objects.filter(materials__study=self).aggregate(
+            count=Count('pk'), last=Max('pk'), updated=Max('updated'),
+        )
+
+    def _questionnaires_data_version(self):
+        from apps.trial.models import Questionnaire
+        return [
+            Questionnaire.objects.filter(study=self).aggregate(count=Count('pk'), last=Max('pk')),
+            Questionnaire.item_lists.through.objects.filter(questionnaire__study=self).aggregate(
+                count=Count('pk'), last=Max('pk'),
+            ),
+        ]
+
+    def questionnaires_data_version(self):
+        return snapshot_version(
+            self.version,
+            self.pseudo_randomize_question_order,
+            list(self.materials.values_list('pk', 'title')),
+            self._items_data_version(),
+            self._questionnaires_data_version(),
+        )
+
+    def design_data_version(self):
+        """Fingerprint of the study design files of the archive, from the study row and counts of its parts."""
+        from apps.item.models import ItemFeedback, ItemList, ItemQuestion
+        from apps.trial.models import QuestionnaireBlock
+        # questions, scales, item questions and feedback and blocks also bump Study.version when saved
+        return snapshot_version(
+            [getattr(self, field.attname) for field in self._meta.concrete_fields],
+            list(self.materials.values_list()),
+            self._items_data_version(),
+            [
+                model.objects.filter(**{lookup: self}).aggregate(count=Count('pk'), last=Max('pk'))
+                for model, lookup in [
+                    (Question, 'study'),
+                    (ScaleValue, 'question__study'),
+                    (ItemQuestion, 'item__materials__study'),
+                    (ItemFeedback, 'item__materials__study'),
+                    (ItemList, 'materials__study'),
+                    (ItemList.items.through, 'itemlist__materials__study'),
+                    (QuestionnaireBlock, 'study'),
+                ]
+            ],
+            self._questionnaires_data_version(),
+        )
+
+    def archive_data_version(self):
+        return snapshot_version(self.results_data_version(), self.design_data_version())
+
     def archive_file(self, fileobj):
         with zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_DEFLATED) as archive:
-            file = io.StringIO()
             for archive_file, archive_func, _, _ in self.ARCHIVE_FILES:
                 if archive_func:
-                    file.truncate(0)
-                    file.seek(0)
-                    archive_func(file)
-                    archive.writestr(archive_file, file.getvalue())
+                    member = archive.open(archive_file, 'w', force_zip64=True)
+                    with io.TextIOWrapper(member, encoding='utf-8', newline='') as file:
+                        archive_func(file)
 
     def archive(self):
         self.delete_participant_information()
@@ -1216,6 +1806,192 @@ class Study(models.Model):
         return steps
 
 
+_generation_executors = {}
+
+
+def _generation_executor(processes):
+    # one pool per process count, kept for the following generations
+    if processes not in _generation_executors:
+        _generation_executors[processes] = ProcessPoolExecutor(processes)
+    return _generation_executors[processes]
+
+
+_export_executor = None
+
+
+def _run_export_job(pk):
+    try:
+        ExportJob.objects.get(pk=pk).run()
+    finally:
+        connection.close()
+
+
+class ExportJob(models.Model):
+    study = models.ForeignKey(
+        Study,
+        on_delete=models.CASCADE,
+        related_name='export_jobs'
+    )
+    EXPORT_RESULTS = 'results'
+    # snapshots are removed by the prefix of their export type, so no type may start with another one
+    EXPORT_RESULTS_PARQUET = 'parquet'
+    EXPORT_PARTICIPANTS = 'participants'
+    EXPORT_QUESTIONNAIRES = 'questionnaires'
+    EXPORT_ARCHIVE = 'archive'
+    EXPORT_TYPE = (
+        (EXPORT_RESULTS, 'Results (CSV)'),
+        (EXPORT_RESULTS_PARQUET, 'Results (Parquet)'),
+        (EXPORT_PARTICIPANTS, 'Participant information (CSV)'),
+        (EXPORT_QUESTIONNAIRES, 'Questionnaires (CSV)'),
+        (EXPORT_ARCHIVE, 'Archive (ZIP)'),
+    )
+    export_type = models.CharField(
+        max_length=20,
+        choices=EXPORT_TYPE,
+    )
+    version = models.CharField(max_length=40)
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_FINISHED = 'finished'
+    STATUS_FAILED = 'failed'
+    STATUS = (
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_FINISHED, 'Finished'),
+        (STATUS_FAILED, 'Failed'),
+    )
+    status = models.CharField(
+        max_length=10,
+        choices=STATUS,
+        default=STATUS_PENDING,
+    )
+    bytes_written = models.BigIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created = models.DateTimeField(default=timezone.now)
+    updated = models.DateTimeField(default=timezone.now)
+    finished = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['-created']
+        unique_together = ['study', 'export_type', 'version']
+        indexes = [
+            models.Index(fields=['status', 'created']),
+        ]
+
+    # running jobs update their timestamp every HEARTBEAT_SECONDS, so only jobs whose worker is gone become stale
+    STALE_AFTER_MINUTES = 10
+    HEARTBEAT_SECONDS = 60
+
+    @staticmethod
+    def snapshot_prefix(study, export_type):
+        return '{}-{}-'.format(study.pk, export_type)
+
+    @property
+    def snapshot_name(self):
+        return self.snapshot_prefix(self.study, self.export_type) + self.version
+
+    @property
+    def is_active(self):
+        return self.status in [self.STATUS_PENDING, self.STATUS_RUNNING]
+
+    @property
+    def is_available(self):
+        return self.status == self.STATUS_FINISHED and snapshot_last_modified(self.snapshot_name) is not None
+
+    @classmethod
+    def request(cls, study, export_type):
+        """Returns the job for the current data version of the export, queueing it if needed."""
+        cls.requeue_stale()
+        version_func = study.EXPORT_FILES[export_type][0]
+        version = version_func()
+        try:
+            with transaction.atomic():
+                job, _ = cls.objects.get_or_create(study=study, export_type=export_type, version=version)
+        except IntegrityError:
+            job = cls.objects.get(study=study, export_type=export_type, version=version)
+        if job.status == cls.STATUS_FAILED or (job.status == cls.STATUS_FINISHED and not job.is_available):
+            cls.objects.filter(pk=job.pk, status=job.status).update(
+                status=cls.STATUS_PENDING, error='', bytes_written=0, created=timezone.now(), finished=None,
+            )
+            job.refresh_from_db()
+        if job.status == cls.STATUS_PENDING and settings.LREX_EXPORT_WORKER_THREADS:
+            job.submit()
+        return job
+
+    def submit(self):
+        global _export_executor
+        if not _export_executor:
+            _export_executor = ThreadPoolExecutor(max_workers=settings.LREX_EXPORT_WORKER_THREADS)
+        _export_executor.submit(_run_export_job, self.pk)
+
+    @classmethod
+    def requeue_stale(cls):
+        stale_before = timezone.now() - timedelta(minutes=cls.STALE_AFTER_MINUTES)
+        return cls.objects.filter(status=cls.STATUS_RUNNING, updated__lt=stale_before).update(
+            status=cls.STATUS_PENDING, bytes_written=0,
+        )
+
+    def _claim(self):
+        return ExportJob.objects.filter(pk=self.pk, status=self.STATUS_PENDING).update(
+            status=self.STATUS_RUNNING, updated=timezone.now(),
+        ) == 1
+
+    def _progress(self, bytes_written):
+        ExportJob.objects.filter(pk=self.pk).update(bytes_written=bytes_written, updated=timezone.now())
+
+    def _heartbeat(self, stopped):
+        try:
+            while not stopped.wait(self.HEARTBEAT_SECONDS):
+                ExportJob.objects.filter(pk=self.pk, status=self.STATUS_RUNNING).update(updated=timezone.now())
+        finally:
+            connection.close()
+
+    def _update_version(self, version_func):
+        # label the snapshot with the data it is built from, which may have changed since the request
+        version = version_func()
+        if version == self.version:
+            return True
+        try:
+            with transaction.atomic():
+                ExportJob.objects.filter(pk=self.pk).update(version=version)
+        except IntegrityError:
+            # another job covers the current data
+            ExportJob.objects.filter(pk=self.pk).delete()
+            return False
+        self.version = version
+        return True
+
+    def run(self):
+        if not self._claim():
+            return False
+        version_func, write_func, binary, _, _, _ = self.study.EXPORT_FILES[self.export_type]
+        stopped = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(stopped,), daemon=True)
+        heartbeat.start()
+        try:
+            if not self._update_version(version_func):
+                return False
+            path = get_snapshot(
+                self.snapshot_name,
+                lambda fileobj: write_func(ProgressFile(fileobj, self._progress)),
+                binary=binary,
+                stale_prefix=self.snapshot_prefix(self.study, self.export_type),
+            )
+        except Exception as e:
+            ExportJob.objects.filter(pk=self.pk).update(
+                status=self.STATUS_FAILED, error='{}: {}'.format(type(e).__name__, e), updated=timezone.now(),
+            )
+            return False
+        finally:
+            stopped.set()
+            heartbeat.join()
+        ExportJob.objects.filter(pk=self.pk).update(
+            status=self.STATUS_FINISHED, bytes_written=os.path.getsize(path), updated=timezone.now(),
+            finished=timezone.now(),
+        )
+        return True
+
+
 class Question(models.Model):
     study = models.ForeignKey(
         Study,
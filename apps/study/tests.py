@@ -0,0 +1,26 @@
+import os
+import tempfile
+
+from django.test import SimpleTestCase, override_settings
+
+from apps.contrib.snapshots import get_snapshot, snapshot_path
+
+from .models import ExportJob, Study
+
+
+class ExportSnapshotTest(SimpleTestCase):
+
+    def _write_snapshots(self, export_types):
+        study = Study(pk=1)
+        names = []
+        for export_type in export_types:
+            prefix = ExportJob.snapshot_prefix(study, export_type)
+            names.append(prefix + 'version')
+            get_snapshot(names[-1], lambda fileobj: fileobj.write('data'), stale_prefix=prefix)
+        return names
+
+    def test_results_csv_keeps_parquet_snapshot(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(LREX_EXPORT_SNAPSHOT_DIR=directory):
+            names = self._write_snapshots([ExportJob.EXPORT_RESULTS_PARQUET, ExportJob.EXPORT_RESULTS])
+            for name in names:
+                self.assertTrue(os.path.exists(snapshot_path(name)), name)
@@ -23,6 +23,14 @@ urlpatterns = [
     path('<slug:study_slug>/consent/', views.StudyConsentUpdateView.as_view(), name='study-consent'),
     path('<slug:study_slug>/intro/', views.StudyIntroUpdateView.as_view(), name='study-intro'),
     path('<slug:study_slug>/results/csv/', views.StudyResultsCSVDownloadView.as_view(), name='study-results-csv'),
+    path('<slug:study_slug>/results/parquet/', views.StudyResultsParquetDownloadView.as_view(),
+         name='study-results-parquet'),
+    path('<slug:study_slug>/exports/', views.StudyExportsView.as_view(), name='study-exports'),
+    path('<slug:study_slug>/exports/start/', views.StudyExportStartView.as_view(), name='study-export-start'),
+    path('<slug:study_slug>/exports/<int:pk>/status/', views.StudyExportStatusView.as_view(),
+         name='study-export-status'),
+    path('<slug:study_slug>/exports/<int:pk>/download/', views.StudyExportDownloadView.as_view(),
+         name='study-export-download'),
     path('<slug:study_slug>/archive/', views.StudyArchiveView.as_view(), name='study-archive'),
     path('<slug:study_slug>/archive/download/', views.StudyArchiveDownloadView.as_view(), name='study-archive-download'),
     path('<slug:study_slug>/restore/', views.StudyRestoreFromArchiveView.as_view(), name='study-archive-restore'),
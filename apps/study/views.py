@@ -1,3 +1,4 @@
+import os
 from tempfile import TemporaryFile
 
 from django.conf import settings
@@ -7,16 +8,18 @@ from django.contrib.auth.models import User
 from django.contrib.messages.views import SuccessMessageMixin
 from django.contrib import messages
 from django.db.models import Q
-from django.http import Http404, HttpResponse
+from django.http import FileResponse, Http404, JsonResponse, StreamingHttpResponse
 from django.shortcuts import redirect
 from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response, patch_cache_control
 from django.urls import reverse
 from django.utils.functional import cached_property
+from django.utils.http import http_date, quote_etag
 from django.utils.safestring import mark_safe
-from django.utils.timezone import now
 from django.views import generic
 
 from apps.contrib import views as contrib_views
+from apps.contrib.snapshots import get_snapshot, snapshot_last_modified, snapshot_path, stream_snapshot
 from apps.contrib.utils import split_list_string
 
 from . import models
@@ -127,6 +130,36 @@ class CheckStudyCreatorMixin(UserPassesTestMixin):
         return False
 
 
+class SnapshotDownloadMixin:
+    export_type = None
+    stream_snapshot = False
+
+    def get(self, request, *args, **kwargs):
+        version_func, write_func, binary, content_type, _, _ = self.study.EXPORT_FILES[self.export_type]
+        version = version_func()
+        prefix = models.ExportJob.snapshot_prefix(self.study, self.export_type)
+        name = prefix + version
+        etag = quote_etag(version)
+        response = get_conditional_response(request, etag=etag, last_modified=snapshot_last_modified(name))
+        if response is None and self.stream_snapshot and snapshot_last_modified(name) is None:
+            response = StreamingHttpResponse(
+                stream_snapshot(name, write_func, binary=binary, stale_prefix=prefix), content_type=content_type,
+            )
+            response['Content-Disposition'] = 'attachment; filename="{}"'.format(
+                self.study.export_filename(self.export_type)
+            )
+        elif response is None:
+            path = get_snapshot(name, write_func, binary=binary, stale_prefix=prefix)
+            response = FileResponse(
+                open(path, 'rb'), as_attachment=True, filename=self.study.export_filename(self.export_type),
+                content_type=content_type,
+            )
+            response['Last-Modified'] = http_date(os.path.getmtime(path))
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+
 class SettingsNavMixin:
 
     def get_context_data(self, **kwargs):
@@ -336,15 +369,10 @@ class StudyArchiveView(
         return super().form_valid(form)
 
 
-class StudyArchiveDownloadView(StudyObjectMixin, CheckStudyCreatorMixin, generic.DetailView):
+class StudyArchiveDownloadView(StudyObjectMixin, CheckStudyCreatorMixin, SnapshotDownloadMixin, generic.DetailView):
     model = models.Study
-
-    def get(self, request, *args, **kwargs):
-        filename = '{}_ARCHIVE_{}.zip'.format(self.study.title.replace(' ', '_'), str(now().date()))
-        response = HttpResponse(content_type='application/zip')
-        response['Content-Disposition'] = 'attachment; filename="' + filename + '"'
-        self.study.archive_file(response)
-        return response
+    export_type = models.ExportJob.EXPORT_ARCHIVE
+    stream_snapshot = True
 
 
 class StudyCreateFromArchiveView(LoginRequiredMixin,  SuccessMessageMixin, generic.FormView):
@@ -472,6 +500,7 @@ class StudySettingsView(
             'disable_itemtype': self.study.has_items,
             'disable_randomize_question_order': self.study.has_questionnaires,
             'disable_use_blocks': self.study.has_questionnaires,
+            'disable_virtual_questionnaires': self.study.has_questionnaires,
             'disable_feedback': self.study.is_active,
         })
         return kwargs
@@ -621,6 +650,10 @@ class QuestionUpdateView(
                 messages.info(request, mark_safe(msg))
         return super().get(request, *args, **kwargs)
 
+    def formset_valid(self):
+        super().formset_valid()
+        self.study.bump_version()
+
     def _invalidate_materials_items(self):
         for materials in self.study.materials.all():
             materials.set_items_validated(False)
@@ -824,12 +857,111 @@ class StudyConsentUpdateView(
         return self.object.get_absolute_url()
 
 
-class StudyResultsCSVDownloadView(StudyObjectMixin, CheckStudyCreatorMixin, generic.DetailView):
+class StudyResultsCSVDownloadView(
+    StudyObjectMixin, CheckStudyCreatorMixin, SnapshotDownloadMixin, generic.DetailView
+):
     model = models.Study
+    export_type = models.ExportJob.EXPORT_RESULTS
+    stream_snapshot = True
+
+
+class StudyResultsParquetDownloadView(
+    StudyObjectMixin, CheckStudyCreatorMixin, SnapshotDownloadMixin, generic.DetailView
+):
+    model = models.Study
+    export_type = models.ExportJob.EXPORT_RESULTS_PARQUET
+    # the Parquet footer is written last, so the file is complete before the first byte can be sent
+    stream_snapshot = False
+
+    def get(self, request, *args, **kwargs):
+        if not self.study.has_parquet_support:
+            raise Http404()
+        return super().get(request, *args, **kwargs)
+
+
+class StudyExportsView(
+    StudyMixin,
+    CheckStudyCreatorMixin,
+    ResultsNavMixin,
+    generic.TemplateView,
+):
+    title = 'Exports'
+    template_name = 'lrex_study/study_exports.html'
+
+    @property
+    def export_types(self):
+        export_types = []
+        for export_type, label in models.ExportJob.EXPORT_TYPE:
+            if export_type == models.ExportJob.EXPORT_PARTICIPANTS and not self.study.has_participant_information:
+                continue
+            if export_type == models.ExportJob.EXPORT_RESULTS_PARQUET and not self.study.has_parquet_support:
+                continue
+            export_types.append((export_type, label))
+        return export_types
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        latest_jobs = {}
+        for job in self.study.export_jobs.all():
+            latest_jobs.setdefault(job.export_type, job)
+        exports = [
+            (export_type, label, latest_jobs.get(export_type)) for export_type, label in self.export_types
+        ]
+        context.update({
+            'nav2_active': 2,
+            'exports': exports,
+            'export_poll': any(job and job.is_active for _, _, job in exports),
+        })
+        return context
+
+
+class StudyExportStartView(StudyMixin, CheckStudyCreatorMixin, generic.View):
+
+    def post(self, request, *args, **kwargs):
+        export_type = request.POST.get('export_type')
+        if export_type not in self.study.EXPORT_FILES:
+            raise Http404()
+        if export_type == models.ExportJob.EXPORT_RESULTS_PARQUET and not self.study.has_parquet_support:
+            raise Http404()
+        job = models.ExportJob.request(self.study, export_type)
+        if job.is_available:
+            messages.info(request, 'The export is up to date and ready for download.')
+        else:
+            messages.info(request, 'Export started. You can leave this page and come back later.')
+        return redirect('study-exports', study_slug=self.study.slug)
+
+
+class ExportJobMixin(StudyMixin):
+
+    @cached_property
+    def job(self):
+        try:
+            return self.study.export_jobs.get(pk=self.kwargs['pk'])
+        except models.ExportJob.DoesNotExist:
+            raise Http404()
+
+
+class StudyExportStatusView(ExportJobMixin, CheckStudyCreatorMixin, generic.View):
 
     def get(self, request, *args, **kwargs):
-        filename = '{}_RESULTS_{}.csv'.format(self.study.title.replace(' ', '_'), now().strftime('%Y-%m-%d-%H%M'))
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; filename="' + filename + '"'
-        self.study.results_csv(response)
+        response = JsonResponse({
+            'status': self.job.status,
+            'status_display': self.job.get_status_display(),
+            'bytes_written': self.job.bytes_written,
+            'error': self.job.error,
+        })
+        patch_cache_control(response, private=True, no_cache=True)
         return response
+
+
+class StudyExportDownloadView(ExportJobMixin, CheckStudyCreatorMixin, generic.View):
+
+    def get(self, request, *args, **kwargs):
+        if not self.job.is_available:
+            messages.error(request, 'The export is not available anymore. Please start it again.')
+            return redirect('study-exports', study_slug=self.study.slug)
+        _, _, _, content_type, _, _ = self.study.EXPORT_FILES[self.job.export_type]
+        return FileResponse(
+            open(snapshot_path(self.job.snapshot_name), 'rb'), as_attachment=True,
+            filename=self.study.export_filename(self.job.export_type), content_type=content_type,
+        )
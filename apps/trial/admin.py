@@ -164,7 +164,11 @@ class TrialAdmin(admin.ModelAdmin):
         'created',
         'ended',
         'participant_id',
+        'number',
         'is_test',
+        'status',
+        'ratings_completed',
+        'last_activity',
     )
     readonly_fields = fields
     search_fields = (
@@ -3,7 +3,6 @@ from crispy_forms.layout import Field, Fieldset, HTML, Layout, Button
 from django import forms
 
 from apps.contrib import forms as contrib_forms
-from apps.contrib.utils import split_list_string
 from apps.item import models as item_models
 
 from . import models
@@ -307,6 +306,18 @@ class DemographicsValueFormsetFactory(contrib_forms.CrispyModelFormsetFactory):
         ]
 
 
+class ScaleValueChoiceField(forms.ModelChoiceField):
+    scale_values = ()
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        for scale_value in self.scale_values:
+            if str(scale_value.pk) == str(value):
+                return scale_value
+        raise forms.ValidationError(self.error_messages['invalid_choice'], code='invalid_choice')
+
+
 class RatingForm(RequiredMessageFromStudyMixin, contrib_forms.CrispyModelForm):
     feedback = forms.CharField(
         max_length=5000,
@@ -321,6 +332,7 @@ class RatingForm(RequiredMessageFromStudyMixin, contrib_forms.CrispyModelForm):
     optional_label_ignore_fields = ['comment', 'feedback']
 
     form_index = None
+    questionnaire_item = None
     question = None
     feedbacks = None
 
@@ -331,11 +343,16 @@ class RatingForm(RequiredMessageFromStudyMixin, contrib_forms.CrispyModelForm):
             'question': forms.HiddenInput(),
             'scale_value': forms.RadioSelect(),
         }
+        field_classes = {
+            'scale_value': ScaleValueChoiceField,
+        }
 
     def __init__(self, *args, **kwargs):
         is_test = kwargs.pop('is_test')
         self.form_index = kwargs.pop('form_index')
+        self.questionnaire_item = kwargs.pop('questionnaire_item')
         self.question = kwargs.pop('question')
+        scale_values = kwargs.pop('scale_values')
         item_question = kwargs.pop('item_question')
         question_property = kwargs.pop('question_property')
         self.feedbacks = kwargs.pop('feedbacks')
@@ -351,20 +368,21 @@ class RatingForm(RequiredMessageFromStudyMixin, contrib_forms.CrispyModelForm):
         self.fields['question'].initial = self.question.number
         scale_value = self.fields.get('scale_value')
         scale_value.queryset = scale_value.queryset.filter(question=self.question)
+        scale_value.scale_values = scale_values
         scale_value.label = (
             item_question.question if item_question and item_question.question else self.question.question
         )
         scale_value.help_text = item_question.legend if item_question and item_question.legend else self.question.legend
-        choices = scale_value.choices
-        if item_question and item_question.scale_labels:
+        choices = [(value.pk, value.label) for value in scale_values]
+        if item_question and item_question.scale_labels_list:
             custom_choices = []
-            for (pk, _), custom_label in zip(scale_value.choices, split_list_string(item_question.scale_labels)):
+            for (pk, _), custom_label in zip(choices, item_question.scale_labels_list):
                 custom_choices.append((pk, custom_label))
             choices = custom_choices
         if question_property and question_property.scale_order:
             reordered_choices = []
             for pos in question_property.scale_order.split(','):
-                reordered_choices.append(list(choices)[int(pos)])
+                reordered_choices.append(choices[int(pos)])
             choices = reordered_choices
         scale_value.choices = choices
 
@@ -375,7 +393,7 @@ class RatingForm(RequiredMessageFromStudyMixin, contrib_forms.CrispyModelForm):
             feedbacks_given = data['feedbacks_given'].split(',')
             feedbacks_for_scale = [
                 f for f in self.feedbacks
-                if f.question == self.question and str(f.pk) not in feedbacks_given and f.show_feedback(scale_value)
+                if f.question_id == self.question.pk and str(f.pk) not in feedbacks_given and f.show_feedback(scale_value)
             ]
             if feedbacks_for_scale:
                 self.data = self.data.copy()
@@ -393,17 +411,25 @@ class RatingFormset(forms.BaseModelFormSet):
     def get_form_kwargs(self, index):
         kwargs = super().get_form_kwargs(index)
         study = kwargs.get('study')
-        questionnaire_item = kwargs.pop('questionnaire_item')
-        question_number = index
+        bundle = study.participation_bundle
+        questionnaire_items = kwargs.pop('questionnaire_items')
+        questionnaire_item = questionnaire_items[index // len(bundle)]
+        question_number = index % len(bundle)
         if questionnaire_item.question_order:
             question_order = questionnaire_item.question_order.split(',')
-            question_number = question_order[index]
+            question_number = int(question_order[question_number])
+        question = bundle.question(question_number)
+        question_property = next(
+            (p for p in questionnaire_item.question_properties.all() if p.number == question_number), None
+        )
         kwargs.update({
             'form_index': index,
-            'question': study.questions.get(number=question_number),
-            'question_property': questionnaire_item.question_properties.filter(number=question_number).first(),
-            'item_question': questionnaire_item.item.item_questions.filter(number=question_number).first(),
-            'feedbacks': list(questionnaire_item.item.item_feedback.all()),
+            'questionnaire_item': questionnaire_item,
+            'question': question,
+            'scale_values': bundle.question_scale_values(question),
+            'question_property': question_property,
+            'item_question': bundle.item_question(questionnaire_item.item_id, question_number),
+            'feedbacks': bundle.feedbacks(questionnaire_item.item_id),
         })
         return kwargs
 
@@ -413,9 +439,15 @@ class RatingFormsetFactory(contrib_forms.CrispyModelFormsetFactory):
     form = RatingForm
     form_tag = False
 
+    def __new__(cls, *args, **kwargs):
+        formset_class = super().__new__(cls, *args, **kwargs)
+        formset_class.helper.disable_csrf = True
+        return formset_class
+
     @staticmethod
     def get_layout(study=None):
         return Layout(
+            'question',
             Field('scale_value', template='lrex_trial/ratings_scale_value_field.html'),
             'feedback',
             'comment',
@@ -0,0 +1,141 @@
+import random
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.trial import randomization
+
+
+def insert_block_slots(block_items, materials_dict, n_tries=1000):
+    # shuffle and insert slot computation as done before the alternating sequence, kept as the baseline
+    filler = list([id for id, materials in materials_dict.items() if materials.is_filler])
+    while n_tries > 0:
+        slots = []
+        items = block_items.copy()
+        random.shuffle(items)
+        colliding = []
+        last_item = None
+        for item in items:
+            if (
+                    item.materials_id in filler
+                    or not last_item
+                    or last_item.materials_id in filler
+                    or last_item.materials_id != item.materials_id
+            ):
+                slots.append(item.materials_id)
+            else:
+                colliding.append(item)
+            last_item = item
+        resolution_failed = False
+        for item in colliding:
+            slot_size = len(slots)
+            n_insert_tries = int(slot_size / 4)
+            while n_insert_tries > 0:
+                pos = random.randint(0, slot_size - 2)
+                if item.materials_id != slots[pos] and item.materials_id != slots[pos + 1]:
+                    slots.insert(pos + 1, item.materials_id)
+                    break
+                n_insert_tries -= 1
+            if n_insert_tries == 0:
+                resolution_failed = True
+        if not resolution_failed:
+            return slots
+        else:
+            n_tries -= 1
+    raise RuntimeError('Unable to compute slots.')
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the run time and failure rate of the block slot computation with the shuffle and insert baseline '
+        'for growing blocks. Does not touch the database.'
+    )
+
+    # (description, share of the block per experimental materials), filler items fill up the rest
+    SHAPES = [
+        ('4 materials, 1/2 filler', [1 / 8] * 4),
+        ('2 materials, 1/5 filler', [2 / 5] * 2),
+        ('3 materials, 1/10 filler', [3 / 10] * 3),
+        ('1 materials, 1/2 filler', [1 / 2]),
+        ('2 materials, no filler', [1 / 2] * 2),
+    ]
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', type=str, default='50,100,500,1000,5000', help='Comma separated numbers of block items.',
+        )
+        parser.add_argument('--repeat', type=int, default=5, help='Slot computations per size, shape and method.')
+        parser.add_argument(
+            '--baseline-max-items', type=int, default=1000,
+            help='Largest block for the baseline, which may take minutes on larger blocks without enough filler items.',
+        )
+        parser.add_argument('--seed', type=int, default=None)
+
+    def _block(self, n_items, shares):
+        materials_dict = {0: SimpleNamespace(title='Filler', is_filler=True)}
+        materials_dict.update({
+            i: SimpleNamespace(title='Exp{}'.format(i), is_filler=False) for i in range(1, len(shares) + 1)
+        })
+        n_items_by_materials = {i: int(n_items * share) for i, share in enumerate(shares, 1)}
+        n_items_by_materials[0] = n_items - sum(n_items_by_materials.values())
+        block_items = [
+            SimpleNamespace(materials_id=id) for id, n in n_items_by_materials.items() for _ in range(n)
+        ]
+        return block_items, materials_dict, n_items_by_materials
+
+    def _is_valid(self, slots, materials_dict, n_items_by_materials):
+        return Counter(slots) == Counter(n_items_by_materials) and all(
+            a != b or materials_dict[a].is_filler for a, b in zip(slots, slots[1:])
+        )
+
+    def _measure(self, compute, n_repeat, materials_dict, n_items_by_materials):
+        n_failed = 0
+        n_invalid = 0
+        start = time.perf_counter()
+        for _ in range(n_repeat):
+            try:
+                slots = compute()
+            except RuntimeError:
+                n_failed += 1
+                continue
+            if not self._is_valid(slots, materials_dict, n_items_by_materials):
+                n_invalid += 1
+        return (time.perf_counter() - start) / n_repeat, n_failed, n_invalid
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',')]
+        except ValueError:
+            raise CommandError('Sizes must be comma separated numbers.')
+        random.seed(options['seed'])
+        n_repeat = options['repeat']
+        row = '{:>6} {:>25} {:>12} {:>8} {:>16} {:>8}'
+        self.stdout.write(row.format('items', 'block', 'baseline ms', 'failed', 'alternating ms', 'failed'))
+        for n_items in sizes:
+            for description, shares in self.SHAPES:
+                block_items, materials_dict, n_items_by_materials = self._block(n_items, shares)
+                if n_items <= options['baseline_max_items']:
+                    baseline_time, baseline_failed, baseline_invalid = self._measure(
+                        lambda: insert_block_slots(block_items, materials_dict),
+                        n_repeat, materials_dict, n_items_by_materials,
+                    )
+                    baseline_time = '{:.1f}'.format(baseline_time * 1000)
+                    baseline_failed = '{}/{}'.format(baseline_failed, n_repeat)
+                else:
+                    baseline_time, baseline_failed, baseline_invalid = '-', '-', 0
+                alternating_time, alternating_failed, alternating_invalid = self._measure(
+                    lambda: randomization.block_slots(block_items, materials_dict, 1),
+                    n_repeat, materials_dict, n_items_by_materials,
+                )
+                if baseline_invalid or alternating_invalid:
+                    raise CommandError('Invalid slots for {} items, {}.'.format(n_items, description))
+                self.stdout.write(row.format(
+                    n_items,
+                    description,
+                    baseline_time,
+                    baseline_failed,
+                    '{:.1f}'.format(alternating_time * 1000),
+                    '{}/{}'.format(alternating_failed, n_repeat),
+                ))
@@ -0,0 +1,68 @@
+import time
+
+from markdownx.utils import markdownify as markdownx_markdownify
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.contrib.markdown import markdownify
+from apps.study import models as study_models
+
+
+class Command(BaseCommand):
+    help = 'Compare the markdown rendering CPU time per participant request with and without the markdown cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('study_slug', type=str)
+        parser.add_argument('--participants', type=int, default=20)
+
+    def _participant_pages(self, study):
+        pages = [
+            [study.intro, study.consent_form_text, study.contact_details],
+            [study.instructions],
+        ]
+        blocks = {block.block: block for block in study.questionnaire_blocks.all()}
+        questionnaire = study.questionnaires.first()
+        last_block = None
+        questionnaire_items = questionnaire.questionnaire_items.select_related(
+            'item__materials', 'item__markdownitem', 'item__audiolinkitem',
+        )
+        for questionnaire_item in questionnaire_items:
+            item = questionnaire_item.item
+            block = blocks.get(item.materials_block)
+            if study.use_blocks and block and item.materials_block != last_block:
+                pages.append([block.instructions])
+                last_block = item.materials_block
+            page = [study.short_instructions]
+            if study.use_blocks and block:
+                page.append(block.short_instructions)
+            if study.has_markdown_items:
+                page.append(item.markdownitem.text)
+            elif study.has_audiolink_items:
+                page.append(item.audiolinkitem.description)
+            pages.append(page)
+        pages.append([study.outro])
+        return pages
+
+    def _cpu_time_per_request(self, pages, n_participants, render):
+        start = time.process_time()
+        for _ in range(n_participants):
+            for page in pages:
+                for text in page:
+                    if text:
+                        render(text)
+        return (time.process_time() - start) / (n_participants * len(pages))
+
+    def handle(self, *args, **options):
+        try:
+            study = study_models.Study.objects.get(slug=options['study_slug'])
+        except study_models.Study.DoesNotExist:
+            raise CommandError('Study does not exist.')
+        if not study.questionnaires.exists():
+            raise CommandError('Study has no questionnaires.')
+        n_participants = options['participants']
+        pages = self._participant_pages(study)
+        before = self._cpu_time_per_request(pages, n_participants, markdownx_markdownify)
+        after = self._cpu_time_per_request(pages, n_participants, markdownify)
+        self.stdout.write('requests per participant: {}'.format(len(pages)))
+        self.stdout.write('markdown cpu per request (uncached): {:.3f} ms'.format(before * 1000))
+        self.stdout.write('markdown cpu per request (cached): {:.3f} ms'.format(after * 1000))
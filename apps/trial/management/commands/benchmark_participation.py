@@ -0,0 +1,250 @@
+import json
+import random
+import re
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from math import ceil
+from string import ascii_lowercase
+from urllib.parse import urlsplit
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+
+from apps.item import models as item_models
+from apps.materials import models as materials_models
+from apps.study import models as study_models
+from apps.trial import models as trial_models
+
+
+class Command(BaseCommand):
+    help = (
+        'Build a synthetic study and drive simulated participants through the participation views '
+        '(intro, trial creation, demographics, ratings, outro). Reports latency percentiles, SQL query counts '
+        'and DB time per view as JSON. Creates and deletes data in the configured database.'
+    )
+
+    BENCHMARK_USER = 'lrex-benchmark'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--participants', type=int, default=20)
+        parser.add_argument('--workers', type=int, default=4, help='Number of concurrent participants.')
+        parser.add_argument('--items', type=int, default=12, help='Items per materials.')
+        parser.add_argument('--conditions', type=int, default=2, help='Conditions of the experimental materials.')
+        parser.add_argument('--questions', type=int, default=1)
+        parser.add_argument('--blocks', type=int, default=1)
+        parser.add_argument(
+            '--randomization',
+            choices=[randomization for randomization, _ in trial_models.QuestionnaireBlock.RANDOMIZATION_TYPE],
+            default=trial_models.QuestionnaireBlock.RANDOMIZATION_TRUE,
+        )
+        parser.add_argument('--items-per-page', type=int, default=1)
+        parser.add_argument('--output', type=str, help='Write the report to this file instead of stdout.')
+        parser.add_argument('--keep', action='store_true', help='Keep the synthetic study.')
+
+    def _create_study(self, options):
+        user, _ = User.objects.get_or_create(username=self.BENCHMARK_USER)
+        use_blocks = options['blocks'] > 1
+        study = study_models.Study.objects.create(
+            title='Benchmark {}'.format(uuid.uuid4().hex[:8]),
+            creator=user,
+            use_blocks=use_blocks,
+            is_published=True,
+            items_per_page=options['items_per_page'],
+            intro='Welcome to this *benchmark* study.',
+            consent_form_text='Synthetic participants only.',
+            instructions='Rate each sentence.',
+            short_instructions='Rate each *sentence*.',
+            outro='Thank you.',
+            contact_name='Benchmark',
+            contact_email='benchmark@example.com',
+        )
+        study_models.DemographicField.objects.create(study=study, number=0, name='Age')
+        for question_number in range(options['questions']):
+            question = study_models.Question.objects.create(
+                study=study,
+                number=question_number,
+                question='How acceptable is this sentence? ({})'.format(question_number + 1),
+                randomize_scale=question_number == 0,
+                rating_comment=study_models.Question.RATING_COMMENT_OPTIONAL,
+            )
+            study_models.ScaleValue.objects.bulk_create([
+                study_models.ScaleValue(question=question, number=i, label=str(i + 1)) for i in range(5)
+            ])
+        conditions = ascii_lowercase[:options['conditions']]
+        for block in range(1, options['blocks'] + 1):
+            for title, is_filler, materials_conditions in [
+                ('Exp{}'.format(block), False, conditions),
+                ('Filler{}'.format(block), True, 'a'),
+            ]:
+                materials = materials_models.Materials.objects.create(
+                    study=study,
+                    title=title,
+                    is_filler=is_filler,
+                    block=block if use_blocks else -1,
+                )
+                for number in range(1, options['items'] + 1):
+                    for condition in materials_conditions:
+                        item_models.TextItem.objects.create(
+                            materials=materials,
+                            number=number,
+                            condition=condition,
+                            text='{} sentence {}{}.'.format(title, number, condition),
+                        )
+                materials.validate_items()
+        study = study_models.Study.objects.get(pk=study.pk)
+        for block in study.item_blocks if use_blocks else [1]:
+            trial_models.QuestionnaireBlock.objects.create(
+                study=study,
+                block=block,
+                randomization=options['randomization'],
+                instructions='Block {} instructions.'.format(block) if use_blocks else '',
+                short_instructions='Block {}'.format(block) if use_blocks else '',
+            )
+        study = study_models.Study.objects.get(pk=study.pk)
+        study.generate_questionnaires()
+        return study
+
+    def _request(self, client, samples, method, url, data=None):
+        url_name = resolve(urlsplit(url).path).url_name
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = getattr(client, method)(url, data or {})
+            elapsed = time.perf_counter() - start
+        db_time = sum(float(query['time']) for query in queries.captured_queries)
+        samples.append(('{} {}'.format(method.upper(), url_name), elapsed, len(queries), db_time))
+        if response.status_code not in (200, 302):
+            raise RuntimeError('{} {} returned {}'.format(method.upper(), url, response.status_code))
+        return response
+
+    @staticmethod
+    def _rating_data(html):
+        data = {
+            'form-TOTAL_FORMS': re.search(r'name="form-TOTAL_FORMS" value="(\d+)"', html).group(1),
+            'form-INITIAL_FORMS': 0,
+            'submit': 'submit',
+        }
+        scale_values = {}
+        for form, scale_value in re.findall(r'name="form-(\d+)-scale_value" id="[^"]*" value="(\d+)"', html):
+            scale_values.setdefault(form, []).append(scale_value)
+        for form, question in re.findall(r'name="form-(\d+)-question" value="(\d+)"', html):
+            data.update({
+                'form-{}-question'.format(form): question,
+                'form-{}-scale_value'.format(form): random.choice(scale_values[form]),
+                'form-{}-comment'.format(form): '',
+                'form-{}-feedbacks_given'.format(form): '',
+            })
+        return data
+
+    def _participate(self, study, n_demographics):
+        client = Client()
+        samples = []
+        error = None
+        try:
+            url = reverse('trial-intro', args=[study.slug])
+            self._request(client, samples, 'get', url)
+            url = self._request(client, samples, 'post', url, {'consent': 'on'})['Location']
+            self._request(client, samples, 'get', url)
+            url = self._request(client, samples, 'post', url, {'participant_id': '', 'password': ''})['Location']
+            while True:
+                match = resolve(urlsplit(url).path)
+                response = self._request(client, samples, 'get', url)
+                if match.url_name == 'rating-outro':
+                    break
+                if response.status_code == 302:
+                    url = response['Location']
+                elif match.url_name == 'rating-block-instructions':
+                    url = reverse('ratings-create', kwargs=match.kwargs)
+                elif match.url_name == 'trial-demographics':
+                    data = {'form-TOTAL_FORMS': n_demographics, 'form-INITIAL_FORMS': 0, 'submit': 'submit'}
+                    for i in range(n_demographics):
+                        data['form-{}-value'.format(i)] = str(random.randint(18, 80))
+                    url = self._request(client, samples, 'post', url, data)['Location']
+                else:
+                    data = self._rating_data(response.content.decode())
+                    url = self._request(client, samples, 'post', url, data)['Location']
+        except Exception as e:
+            error = '{}: {}'.format(type(e).__name__, e)
+        finally:
+            connection.close()
+        return samples, error
+
+    @staticmethod
+    def _percentile(values, percent):
+        values = sorted(values)
+        return values[max(0, ceil(percent / 100 * len(values)) - 1)]
+
+    def _view_report(self, samples):
+        latencies = [sample[1] * 1000 for sample in samples]
+        queries = [sample[2] for sample in samples]
+        db_times = [sample[3] * 1000 for sample in samples]
+        return {
+            'requests': len(samples),
+            'latency_ms': {
+                'p50': round(self._percentile(latencies, 50), 3),
+                'p95': round(self._percentile(latencies, 95), 3),
+                'p99': round(self._percentile(latencies, 99), 3),
+                'max': round(max(latencies), 3),
+            },
+            'queries': {
+                'mean': round(sum(queries) / len(queries), 2),
+                'max': max(queries),
+                'total': sum(queries),
+            },
+            'db_time_ms': {
+                'mean': round(sum(db_times) / len(db_times), 3),
+                'total': round(sum(db_times), 3),
+            },
+        }
+
+    def handle(self, *args, **options):
+        if options['participants'] < 1 or options['workers'] < 1:
+            raise CommandError('Participants and workers must be positive.')
+        study = self._create_study(options)
+        try:
+            n_demographics = study.demographics.count()
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+                futures = [
+                    executor.submit(self._participate, study, n_demographics)
+                    for _ in range(options['participants'])
+                ]
+            wall_time = time.perf_counter() - start
+            samples_by_view = {}
+            errors = []
+            for future in futures:
+                samples, error = future.result()
+                if error:
+                    errors.append(error)
+                for sample in samples:
+                    samples_by_view.setdefault(sample[0], []).append(sample)
+            n_requests = sum(len(samples) for samples in samples_by_view.values())
+            report = {
+                'config': {
+                    key: options[key] for key in [
+                        'participants', 'workers', 'items', 'conditions', 'questions', 'blocks', 'randomization',
+                        'items_per_page',
+                    ]
+                },
+                'database': connection.vendor,
+                'questionnaire_length': study.questionnaire_length,
+                'wall_time_s': round(wall_time, 3),
+                'requests': n_requests,
+                'requests_per_participant': round(n_requests / options['participants'], 2),
+                'requests_per_second': round(n_requests / wall_time, 2),
+                'errors': errors,
+                'views': {view: self._view_report(samples) for view, samples in sorted(samples_by_view.items())},
+            }
+        finally:
+            if not options['keep']:
+                study.delete()
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
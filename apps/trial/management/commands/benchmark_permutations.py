@@ -0,0 +1,77 @@
+import random
+import time
+import tracemalloc
+from collections import Counter
+from itertools import permutations
+from math import ceil, factorial
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.trial import randomization
+
+
+def list_random_permutations(values, n_items, rng):
+    # permutation sampling as done before the rank based sampler, kept as the baseline
+    all_permutations = list(permutations(values))
+    per_permutation = ceil(n_items / len(all_permutations))
+    all_permutations = per_permutation * all_permutations
+    rng.shuffle(all_permutations)
+    return all_permutations[:n_items]
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the run time and peak memory of the question and scale order permutation sampling with the '
+        'baseline listing all permutations. Does not touch the database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--values', type=str, default='2,3,5,7,9', help='Comma separated numbers of questions or scale values.',
+        )
+        parser.add_argument('--items', type=str, default='24,200', help='Comma separated numbers of items.')
+        parser.add_argument('--repeat', type=int, default=3, help='Samples per size and method.')
+        parser.add_argument('--seed', type=int, default=None)
+
+    def _measure(self, sample, values, n_items, n_repeat, rng):
+        max_count = 0
+        tracemalloc.start()
+        start = time.perf_counter()
+        for _ in range(n_repeat):
+            sampled = sample(values, n_items, rng)
+            if len(sampled) != n_items or any(sorted(permutation) != values for permutation in sampled):
+                raise CommandError('Invalid permutations for {} values and {} items.'.format(len(values), n_items))
+            max_count = max(max_count, max(Counter(sampled).values()))
+        wall_time = (time.perf_counter() - start) / n_repeat
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return wall_time, peak, max_count
+
+    def handle(self, *args, **options):
+        try:
+            value_counts = [int(count) for count in options['values'].split(',')]
+            item_counts = [int(count) for count in options['items'].split(',')]
+        except ValueError:
+            raise CommandError('Values and items must be comma separated numbers.')
+        rng = random.Random(options['seed'])
+        row = '{:>6} {:>6} {:>9} {:>12} {:>12} {:>12} {:>12} {:>10}'
+        self.stdout.write(row.format(
+            'values', 'items', 'max uses', 'baseline ms', 'baseline KiB', 'rank ms', 'rank KiB', 'max used',
+        ))
+        for n_values in value_counts:
+            values = list(range(n_values))
+            for n_items in item_counts:
+                (baseline_time, baseline_peak, baseline_count), (rank_time, rank_peak, rank_count) = [
+                    self._measure(sample, values, n_items, options['repeat'], rng)
+                    for sample in (list_random_permutations, randomization._random_permutations)
+                ]
+                self.stdout.write(row.format(
+                    n_values,
+                    n_items,
+                    ceil(n_items / factorial(n_values)),
+                    '{:.1f}'.format(baseline_time * 1000),
+                    '{:.0f}'.format(baseline_peak / 1024),
+                    '{:.1f}'.format(rank_time * 1000),
+                    '{:.0f}'.format(rank_peak / 1024),
+                    '{}/{}'.format(baseline_count, rank_count),
+                ))
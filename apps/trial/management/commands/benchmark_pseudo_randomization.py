@@ -0,0 +1,198 @@
+import random
+import time
+from collections import Counter, deque
+from math import sqrt
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.trial import randomization
+
+
+def shuffle_materials_items_with_alternating_conditions(materials_items, n_tries=1000):
+    # shuffle and bubble pseudo-randomization as done before the constructive pick, kept as the baseline
+    original_items = deque(materials_items)
+    while n_tries:
+        items = original_items.copy()
+        pseudo_random_items = deque()
+        random.shuffle(items)
+        last_item = None
+        bubble_fails = 0
+        while bubble_fails <= len(items):
+            try:
+                item = items.popleft()
+            except IndexError:
+                break
+            if not last_item or last_item.condition != item.condition:
+                pseudo_random_items.append(item)
+                bubble_fails = 0
+            else:
+                items.append(item)
+                bubble_fails += 1
+            last_item = item
+        if len(items) == 0:
+            return pseudo_random_items
+        n_tries -= 1
+    raise RuntimeError('Unable to compute alternating conditions.')
+
+
+def alternating_sequences(conditions):
+    sequences = set()
+
+    def extend(sequence, counts):
+        if len(sequence) == len(conditions):
+            sequences.add(tuple(sequence))
+            return
+        for condition in counts:
+            if counts[condition] and (not sequence or sequence[-1] != condition):
+                counts[condition] -= 1
+                sequence.append(condition)
+                extend(sequence, counts)
+                sequence.pop()
+                counts[condition] += 1
+
+    extend([], Counter(conditions))
+    return sequences
+
+
+def chi_square_z(counts, expected_sequences, n_samples):
+    # chi-square against the uniform distribution over all alternating sequences, with the Wilson-Hilferty
+    # approximation of its z-score
+    expected = n_samples / len(expected_sequences)
+    chi_square = sum((counts.get(sequence, 0) - expected) ** 2 / expected for sequence in expected_sequences)
+    dof = len(expected_sequences) - 1
+    if dof == 0:
+        return chi_square, dof, 0.0
+    z = ((chi_square / dof) ** (1 / 3) - (1 - 2 / (9 * dof))) / sqrt(2 / (9 * dof))
+    return chi_square, dof, z
+
+
+def total_variation(counts_a, counts_b, n_samples):
+    sequences = set(counts_a) | set(counts_b)
+    return sum(abs(counts_a.get(sequence, 0) - counts_b.get(sequence, 0)) for sequence in sequences) / 2 / n_samples
+
+
+def max_position_difference(counts_a, counts_b, n_samples):
+    # largest difference between the frequencies of a condition at a position
+    frequencies = []
+    for counts in (counts_a, counts_b):
+        position_counts = Counter()
+        for sequence, count in counts.items():
+            for position, condition in enumerate(sequence):
+                position_counts[position, condition] += count
+        frequencies.append(position_counts)
+    keys = set(frequencies[0]) | set(frequencies[1])
+    return max(abs(frequencies[0].get(key, 0) - frequencies[1].get(key, 0)) for key in keys) / n_samples
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the output distribution and run time of the alternating conditions pseudo-randomization with the '
+        'shuffle and bubble baseline. Does not touch the database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--cases', type=str, default='aabb,aaabbb,aabbcc,aaabbbccc,aaabbbcccddd,aaaabb,aaaabbbb,aaaaabbbbccc',
+            help='Comma separated condition multisets, one letter per item.',
+        )
+        parser.add_argument('--samples', type=int, default=20000, help='Sequences drawn per case and method.')
+        parser.add_argument(
+            '--sizes', type=str, default='100,1000,10000', help='Comma separated item counts for the timing runs.',
+        )
+        parser.add_argument('--seed', type=int, default=None)
+
+    def _items(self, conditions):
+        return [SimpleNamespace(pk=i, condition=condition) for i, condition in enumerate(conditions)]
+
+    def _methods(self):
+        materials = SimpleNamespace(title='Benchmark')
+        return [
+            ('baseline', shuffle_materials_items_with_alternating_conditions),
+            (
+                'constructive',
+                lambda items: randomization.materials_items_with_alternating_conditions(items, materials, 1),
+            ),
+        ]
+
+    def _sample(self, method, items, n_samples):
+        # stops at the first failure, infeasible cases fail every time
+        counts = Counter()
+        start = time.perf_counter()
+        for i in range(n_samples):
+            try:
+                sequence = tuple(item.condition for item in method(list(items)))
+            except RuntimeError:
+                return counts, True, (time.perf_counter() - start) / (i + 1)
+            counts[sequence] += 1
+        return counts, False, (time.perf_counter() - start) / n_samples
+
+    def _compare_distributions(self, cases, n_samples):
+        row = '{:>14} {:>6} {:>12} {:>7} {:>8} {:>8} {:>9} {:>7} {:>7} {:>9} {:>7}'
+        self.stdout.write(row.format(
+            'conditions', 'valid', 'method', 'failed', 'invalid', 'seen', 'chi2/dof', 'z', 'TV', 'position', 'us/seq',
+        ))
+        for conditions in cases:
+            items = self._items(conditions)
+            expected_sequences = alternating_sequences(conditions)
+            results = []
+            for name, method in self._methods():
+                counts, failed, sequence_time = self._sample(method, items, n_samples)
+                results.append(counts)
+                n_invalid = sum(count for sequence, count in counts.items() if sequence not in expected_sequences)
+                chi_square_dof, z = '-', '-'
+                if not failed and len(expected_sequences) > 1:
+                    chi_square, dof, z = chi_square_z(counts, expected_sequences, n_samples)
+                    chi_square_dof, z = '{:.2f}'.format(chi_square / dof), '{:.1f}'.format(z)
+                self.stdout.write(row.format(
+                    conditions,
+                    len(expected_sequences),
+                    name,
+                    'yes' if failed else 'no',
+                    n_invalid,
+                    len(counts),
+                    chi_square_dof,
+                    z,
+                    '',
+                    '',
+                    '{:.1f}'.format(sequence_time * 1e6),
+                ))
+            if all(sum(counts.values()) == n_samples for counts in results):
+                self.stdout.write(row.format(
+                    '', '', 'difference', '', '', '', '', '',
+                    '{:.3f}'.format(total_variation(*results, n_samples)),
+                    '{:.3f}'.format(max_position_difference(*results, n_samples)),
+                    '',
+                ))
+
+    def _compare_times(self, sizes):
+        self.stdout.write('')
+        self.stdout.write('{:>9} {:>12} {:>12} {:>16}'.format('items', 'conditions', 'baseline ms', 'constructive ms'))
+        for n_items in sizes:
+            shapes = [
+                ('2', ['ab'[i % 2] for i in range(n_items)]),
+                ('4', ['abcd'[i % 4] for i in range(n_items)]),
+                # half of the items in one condition, the rest spread over two others
+                ('1/2,1/4,1/4', ['a' if i % 2 else 'bc'[i // 2 % 2] for i in range(n_items)]),
+            ]
+            for shape, conditions in shapes:
+                items = self._items(conditions)
+                times = []
+                for _, method in self._methods():
+                    start = time.perf_counter()
+                    try:
+                        method(list(items))
+                        times.append('{:.1f}'.format((time.perf_counter() - start) * 1000))
+                    except RuntimeError:
+                        times.append('failed {:.1f}'.format((time.perf_counter() - start) * 1000))
+                self.stdout.write('{:>9} {:>12} {:>12} {:>16}'.format(n_items, shape, *times))
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',')]
+        except ValueError:
+            raise CommandError('Sizes must be comma separated numbers.')
+        cases = [case for case in options['cases'].split(',') if case]
+        random.seed(options['seed'])
+        self._compare_distributions(cases, options['samples'])
+        self._compare_times(sizes)
@@ -30,12 +30,16 @@ class Command(BaseCommand):
             if study.participant_id == study.PARTICIPANT_ID_ENTER:
                 trial.participant_id = i
             trial.save()
-            for questionnaire_item in questionnaire.questionnaire_items.all():
+            questionnaire.materialize()
+            ratings = []
+            for questionnaire_item in questionnaire.questionnaire_items.select_related('item'):
                 for question, question_scale_values in questions_scale_values:
                     scale_value = random.choice(question_scale_values)
-                    trial_models.Rating.objects.create(
+                    ratings.append(trial_models.Rating.objects.create(
                         trial=trial,
                         questionnaire_item=questionnaire_item,
                         scale_value=scale_value,
                         question=question
-                    )
+                    ))
+            trial_models.RatingAggregate.add_ratings(trial, ratings)
+            trial.update_progress()
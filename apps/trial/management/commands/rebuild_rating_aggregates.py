@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count
+
+from apps.study import models as study_models
+from apps.trial import models as trial_models
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the stored rating aggregates from the ratings'
+
+    BATCH_SIZE = 1000
+
+    def add_arguments(self, parser):
+        parser.add_argument('study_slug', type=str, nargs='?')
+
+    def handle(self, *args, **options):
+        aggregates = trial_models.RatingAggregate.objects.all()
+        ratings = trial_models.Rating.objects.all()
+        study_slug = options['study_slug']
+        if study_slug:
+            try:
+                study = study_models.Study.objects.get(slug=study_slug)
+            except study_models.Study.DoesNotExist:
+                raise CommandError('Study does not exist.')
+            aggregates = aggregates.filter(materials__study=study)
+            ratings = ratings.filter(questionnaire_item__item__materials__study=study)
+        ratings = ratings.order_by().values(
+            'questionnaire_item__item__materials_id', 'questionnaire_item__item_id',
+            'questionnaire_item__item__condition', 'trial_id', 'trial__number', 'question', 'scale_value_id',
+        ).annotate(n_ratings=Count('pk'))
+        n_aggregates = 0
+        with transaction.atomic():
+            aggregates.delete()
+            batch = []
+            for rating in ratings.iterator():
+                batch.append(trial_models.RatingAggregate(
+                    materials_id=rating['questionnaire_item__item__materials_id'],
+                    item_id=rating['questionnaire_item__item_id'],
+                    condition=rating['questionnaire_item__item__condition'],
+                    trial_id=rating['trial_id'],
+                    participant=rating['trial__number'],
+                    question=rating['question'],
+                    scale_value_id=rating['scale_value_id'],
+                    count=rating['n_ratings'],
+                ))
+                if len(batch) == self.BATCH_SIZE:
+                    trial_models.RatingAggregate.objects.bulk_create(batch)
+                    n_aggregates += len(batch)
+                    batch = []
+            trial_models.RatingAggregate.objects.bulk_create(batch)
+            n_aggregates += len(batch)
+        self.stdout.write('Rebuilt {} rating aggregates.'.format(n_aggregates))
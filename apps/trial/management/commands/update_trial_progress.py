@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, Max, Q
+
+from apps.study import models as study_models
+from apps.trial import models as trial_models
+
+
+class Command(BaseCommand):
+    help = 'Recompute stored rating progress, last activity and status of trials'
+
+    BATCH_SIZE = 1000
+
+    def add_arguments(self, parser):
+        parser.add_argument('study_slug', type=str, nargs='?')
+
+    def handle(self, *args, **options):
+        trials = trial_models.Trial.objects.all()
+        study_slug = options['study_slug']
+        if study_slug:
+            try:
+                study = study_models.Study.objects.get(slug=study_slug)
+            except study_models.Study.DoesNotExist:
+                raise CommandError('Study does not exist.')
+            trials = trials.filter(questionnaire__study=study)
+        trials = trials.select_related('questionnaire').annotate(
+            n_ratings=Count('rating', filter=Q(rating__question=0)),
+            latest_rating=Max('rating__created'),
+        )
+        updated_trials = []
+        for trial in trials.iterator():
+            trial.ratings_completed = trial.n_ratings
+            trial.last_activity = trial.latest_rating or trial.created
+            trial.status = trial.compute_status(trial.ratings_completed)
+            updated_trials.append(trial)
+        trial_models.Trial.objects.bulk_update(
+            updated_trials, ['ratings_completed', 'last_activity', 'status'], batch_size=self.BATCH_SIZE
+        )
+        self.stdout.write('Updated {} trials.'.format(len(updated_trials)))
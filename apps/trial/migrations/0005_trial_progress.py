@@ -0,0 +1,56 @@
+# Generated by Django 3.2.25 on 2026-10-18 00:54
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Q
+
+
+def update_trial_progress(apps, schema_editor):
+    Questionnaire = apps.get_model('lrex_trial', 'Questionnaire')
+    Trial = apps.get_model('lrex_trial', 'Trial')
+    questionnaire_lengths = dict(
+        Questionnaire.objects.annotate(n_items=Count('questionnaire_items')).values_list('pk', 'n_items')
+    )
+    trials = Trial.objects.annotate(
+        n_ratings=Count('rating', filter=Q(rating__question=0)),
+        latest_rating=Max('rating__created'),
+    )
+    for trial in trials:
+        trial.ratings_completed = trial.n_ratings
+        trial.last_activity = trial.latest_rating or trial.created
+        if trial.is_test:
+            trial.status = 'test'
+        elif trial.ratings_completed >= questionnaire_lengths[trial.questionnaire_id]:
+            trial.status = 'finished'
+        else:
+            trial.status = 'active'
+        trial.save(update_fields=['ratings_completed', 'last_activity', 'status'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lrex_trial', '0004_auto_20210212_0809'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trial',
+            name='last_activity',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='trial',
+            name='ratings_completed',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='trial',
+            name='status',
+            field=models.CharField(choices=[('active', 'Active'), ('finished', 'Finished'), ('test', 'Test')], default='active', help_text='Active, finished or test. Active trials without activity for an hour count as abandoned, which is derived from the last activity and not stored.', max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='trial',
+            index=models.Index(fields=['status', 'last_activity'], name='lrex_trial__status_2089c1_idx'),
+        ),
+        migrations.RunPython(update_trial_progress, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 3.2.25 on 2026-10-18 00:55
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def update_questionnaire_trial_counts(apps, schema_editor):
+    Questionnaire = apps.get_model('lrex_trial', 'Questionnaire')
+    questionnaires = Questionnaire.objects.annotate(
+        n_trials=Count('trial', filter=Q(trial__is_test=False)),
+        n_test_trials=Count('trial', filter=Q(trial__is_test=True)),
+    )
+    for questionnaire in questionnaires:
+        questionnaire.trial_count = questionnaire.n_trials
+        questionnaire.test_trial_count = questionnaire.n_test_trials
+        questionnaire.save(update_fields=['trial_count', 'test_trial_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lrex_trial', '0005_trial_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='questionnaire',
+            name='test_trial_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='questionnaire',
+            name='trial_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='questionnaire',
+            index=models.Index(fields=['study', 'trial_count', 'number'], name='lrex_trial__study_i_dbeeca_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='questionnaire',
+            index=models.Index(fields=['study', 'test_trial_count', 'number'], name='lrex_trial__study_i_4b76f1_idx'),
+        ),
+        migrations.RunPython(update_questionnaire_trial_counts, migrations.RunPython.noop),
+    ]
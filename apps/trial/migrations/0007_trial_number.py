@@ -0,0 +1,43 @@
+# Generated by Django 3.2.25 on 2026-10-18 01:00
+
+from django.db import migrations, models
+
+
+def number_trials(apps, schema_editor):
+    Trial = apps.get_model('lrex_trial', 'Trial')
+    trials = Trial.objects.annotate(
+        study_id=models.F('questionnaire__study_id'),
+    ).order_by('study_id', 'is_test', 'created', 'pk')
+    last_key = None
+    number = 0
+    batch = []
+    for trial in trials.iterator():
+        key = (trial.study_id, trial.is_test)
+        number = number + 1 if key == last_key else 1
+        last_key = key
+        trial.number = number
+        batch.append(trial)
+        if len(batch) >= 1000:
+            Trial.objects.bulk_update(batch, ['number'])
+            batch = []
+    Trial.objects.bulk_update(batch, ['number'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lrex_trial', '0006_questionnaire_trial_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trial',
+            name='number',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='trial',
+            index=models.Index(fields=['questionnaire', 'is_test', 'number'], name='lrex_trial__questio_1e1c45_idx'),
+        ),
+        migrations.RunPython(number_trials, migrations.RunPython.noop),
+    ]
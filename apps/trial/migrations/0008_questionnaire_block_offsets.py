@@ -0,0 +1,54 @@
+# Generated by Django 3.2.25 on 2026-10-18 01:05
+
+from itertools import groupby
+
+from django.db import migrations, models
+
+
+def item_block(use_blocks, block, materials_block, materials_is_example):
+    if not use_blocks:
+        return 1
+    if materials_is_example:
+        return 0
+    if materials_block > 0:
+        return materials_block
+    return block
+
+
+def update_block_offsets(apps, schema_editor):
+    Questionnaire = apps.get_model('lrex_trial', 'Questionnaire')
+    QuestionnaireItem = apps.get_model('lrex_trial', 'QuestionnaireItem')
+    questionnaire_items = QuestionnaireItem.objects.values_list(
+        'questionnaire_id',
+        'questionnaire__study__use_blocks',
+        'item__block',
+        'item__materials__block',
+        'item__materials__is_example',
+    ).order_by('questionnaire_id', 'number')
+    questionnaires = []
+    for questionnaire_id, rows in groupby(questionnaire_items.iterator(), lambda row: row[0]):
+        block_offsets = []
+        last_block = None
+        for i, row in enumerate(rows):
+            block = item_block(*row[1:])
+            if block != last_block:
+                block_offsets.append('{}:{}'.format(block, i))
+                last_block = block
+        questionnaires.append(Questionnaire(pk=questionnaire_id, block_offsets=','.join(block_offsets)))
+    Questionnaire.objects.bulk_update(questionnaires, ['block_offsets'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lrex_trial', '0007_trial_number'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='questionnaire',
+            name='block_offsets',
+            field=models.TextField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(update_block_offsets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 3.2.25 on 2026-10-18 01:13
+
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+
+
+def build_rating_aggregates(apps, schema_editor):
+    Rating = apps.get_model('lrex_trial', 'Rating')
+    RatingAggregate = apps.get_model('lrex_trial', 'RatingAggregate')
+    ratings = Rating.objects.order_by().values(
+        'questionnaire_item__item__materials_id', 'questionnaire_item__item_id',
+        'questionnaire_item__item__condition', 'trial_id', 'trial__number', 'question', 'scale_value_id',
+    ).annotate(n_ratings=Count('pk'))
+    aggregates = [
+        RatingAggregate(
+            materials_id=rating['questionnaire_item__item__materials_id'],
+            item_id=rating['questionnaire_item__item_id'],
+            condition=rating['questionnaire_item__item__condition'],
+            trial_id=rating['trial_id'],
+            participant=rating['trial__number'],
+            question=rating['question'],
+            scale_value_id=rating['scale_value_id'],
+            count=rating['n_ratings'],
+        )
+        for rating in ratings.iterator()
+    ]
+    RatingAggregate.objects.bulk_create(aggregates, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lrex_study', '0011_study_items_per_page'),
+        ('lrex_item', '0003_alter_itemfeedback_scale_values'),
+        ('lrex_materials', '0001_initial'),
+        ('lrex_trial', '0008_questionnaire_block_offsets'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RatingAggregate',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('condition', models.CharField(max_length=16)),
+                ('participant', models.IntegerField()),
+                ('question', models.IntegerField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='lrex_item.item')),
+                ('materials', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rating_aggregates', to='lrex_materials.materials')),
+                ('scale_value', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='lrex_study.scalevalue')),
+                ('trial', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='lrex_trial.trial')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='ratingaggregate',
+            index=models.Index(fields=['materials', 'condition'], name='lrex_trial__materia_f361d8_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ratingaggregate',
+            index=models.Index(fields=['materials', 'participant', 'condition'], name='lrex_trial__materia_2eb617_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='ratingaggregate',
+            unique_together={('materials', 'item', 'trial', 'question', 'scale_value')},
+        ),
+        migrations.RunPython(build_rating_aggregates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-18 01:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lrex_trial', '0009_rating_aggregate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='questionnaire',
+            name='block_randomization',
+            field=models.TextField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='questionnaire',
+            name='materialized',
+            field=models.BooleanField(default=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='questionnaire',
+            name='seed',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -1,7 +1,4 @@
-from collections import deque
-from itertools import groupby
-from itertools import permutations
-from math import ceil
+from bisect import bisect_right
 import random
 import string
 import uuid
@@ -9,15 +6,62 @@ import uuid
 from markdownx.models import MarkdownxField
 
 from datetime import timedelta
-from django.db import models
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models, transaction
 from django.urls import reverse
 from django.utils.functional import cached_property
 from django.utils import timezone
 
+from apps.contrib.markdown import render_markdown_fields
 from apps.contrib.utils import strip_html_in_markdown_fields
 from apps.item import models as item_models
 from apps.study import models as study_models
 
+from . import randomization
+
+
+class ParticipationPlan:
+    """Item order and block boundaries of a questionnaire, as needed while a trial is in progress."""
+
+    def __init__(self, questionnaire_item_ids, block_offsets):
+        self.questionnaire_item_ids = tuple(questionnaire_item_ids)
+        self.block_numbers = tuple(block for block, _ in block_offsets)
+        self.block_starts = tuple(start for _, start in block_offsets)
+
+    def __len__(self):
+        return len(self.questionnaire_item_ids)
+
+    def questionnaire_item_id(self, num):
+        return self.questionnaire_item_ids[num]
+
+    def block(self, num):
+        if not self.block_starts or not 0 <= num < len(self):
+            return None
+        i = bisect_right(self.block_starts, num)
+        return self.block_numbers[i - 1] if i else None
+
+    def block_end(self, num):
+        i = bisect_right(self.block_starts, num)
+        return self.block_starts[i] if i < len(self.block_starts) else len(self)
+
+    def is_last(self, num):
+        return num == len(self) - 1
+
+    def is_block_start(self, num):
+        return 0 < num < len(self) and num in self.block_starts
+
+    def page_end(self, num, items_per_page):
+        end = self.block_end(num)
+        return min(num + items_per_page, end) if items_per_page else end
+
+    def next_url_name(self, num, use_blocks):
+        if self.is_last(num):
+            return 'rating-outro'
+        if use_blocks and self.is_block_start(num + 1):
+            return 'rating-block-instructions'
+        return 'ratings-create'
+
 
 class Questionnaire(models.Model):
     slug = models.SlugField(
@@ -31,9 +75,40 @@ class Questionnaire(models.Model):
     )
     number = models.IntegerField()
     item_lists = models.ManyToManyField(item_models.ItemList)
+    trial_count = models.IntegerField(
+        default=0,
+        editable=False,
+    )
+    test_trial_count = models.IntegerField(
+        default=0,
+        editable=False,
+    )
+    block_offsets = models.TextField(
+        blank=True,
+        null=True,
+        editable=False,
+    )
+    seed = models.BigIntegerField(
+        blank=True,
+        null=True,
+        editable=False,
+    )
+    block_randomization = models.TextField(
+        blank=True,
+        null=True,
+        editable=False,
+    )
+    materialized = models.BooleanField(
+        default=True,
+        editable=False,
+    )
 
     class Meta:
         ordering = ['number']
+        indexes = [
+            models.Index(fields=['study', 'trial_count', 'number']),
+            models.Index(fields=['study', 'test_trial_count', 'number']),
+        ]
 
     @staticmethod
     def compute_slug(study, number):
@@ -54,6 +129,84 @@ class Questionnaire(models.Model):
             in self.questionnaire_items.all().prefetch_related('item')
         ]
 
+    PARTICIPATION_PLAN_CACHE_TIMEOUT = 24 * 60 * 60
+
+    @property
+    def participation_plan_cache_key(self):
+        return 'lrex-participation-plan-{}'.format(self.pk)
+
+    @cached_property
+    def block_offsets_list(self):
+        if not self.block_offsets:
+            return []
+        return [tuple(int(n) for n in block_offset.split(':')) for block_offset in self.block_offsets.split(',')]
+
+    def set_block_offsets(self, item_blocks):
+        block_offsets = []
+        last_block = None
+        for i, block in enumerate(item_blocks):
+            if block != last_block:
+                block_offsets.append('{}:{}'.format(block, i))
+                last_block = block
+        self.block_offsets = ','.join(block_offsets)
+        self.__dict__.pop('block_offsets_list', None)
+
+    @cached_property
+    def block_randomization_dict(self):
+        if not self.block_randomization:
+            return {}
+        return {
+            int(block): randomization
+            for block, randomization in (
+                block_randomization.split(':') for block_randomization in self.block_randomization.split(',')
+            )
+        }
+
+    def set_block_randomization(self, block_randomization):
+        self.block_randomization = ','.join(
+            '{}:{}'.format(block, randomization) for block, randomization in sorted(block_randomization.items())
+        )
+        self.__dict__.pop('block_randomization_dict', None)
+
+    def materialize(self):
+        """Stores the item order derived from the seed of a virtual questionnaire."""
+        if self.materialized:
+            return
+        with transaction.atomic():
+            # the conditional update lets only one of several concurrently starting trials store the items
+            claimed = Questionnaire.objects.filter(pk=self.pk, materialized=False).update(materialized=True)
+            if claimed:
+                self.study.save_generated_questionnaires([self], self.study.derive_questionnaires([self]))
+        self.refresh_from_db(fields=['block_offsets', 'materialized'])
+        self.__dict__.pop('block_offsets_list', None)
+        self.__dict__.pop('participation_plan', None)
+        cache.delete(self.participation_plan_cache_key)
+
+    def _update_block_offsets(self):
+        # questionnaires stored without block offsets get them from their items
+        use_blocks = self.study.use_blocks
+        questionnaire_items = self.questionnaire_items.order_by('number').values_list(
+            'item__block', 'item__materials__block', 'item__materials__is_example',
+        )
+        self.set_block_offsets([
+            item_models.Item.compute_materials_block(*row) if use_blocks else 1 for row in questionnaire_items
+        ])
+        Questionnaire.objects.filter(pk=self.pk).update(block_offsets=self.block_offsets)
+
+    def _compute_participation_plan(self):
+        if not self.block_offsets:
+            self._update_block_offsets()
+        questionnaire_item_ids = self.questionnaire_items.order_by('number').values_list('pk', flat=True)
+        return ParticipationPlan(questionnaire_item_ids, self.block_offsets_list)
+
+    @cached_property
+    def participation_plan(self):
+        plan = cache.get(self.participation_plan_cache_key)
+        if plan is None:
+            plan = self._compute_participation_plan()
+            cache.set(self.participation_plan_cache_key, plan, self.PARTICIPATION_PLAN_CACHE_TIMEOUT)
+        return plan
+
     @cached_property
     def questionnaire_items_preview(self):
         queryset = self.questionnaire_items.prefetch_related(
@@ -64,192 +217,6 @@ class Questionnaire(models.Model):
         queryset = queryset[:10]
         return queryset
 
-    def _generate_block_items(self, block_items, block_offset):
-        questionnaire_items = []
-        for i, item in enumerate(block_items):
-            questionnaire_item = QuestionnaireItem(
-                number=block_offset + i,
-                questionnaire=self,
-                item=item,
-            )
-            questionnaire_items.append(questionnaire_item)
-        return questionnaire_items
-
-    def _generate_items_random(self, block_items, block_offset):
-        random.shuffle(block_items)
-        return self._generate_block_items(block_items, block_offset)
-
-    PSEUDO_RANDOMIZE_TRIES = 1000
-
-    def _materials_items_with_alternating_conditions(self, materials_items):
-        n_tries = self.PSEUDO_RANDOMIZE_TRIES
-        original_items = deque(materials_items)
-        while n_tries:
-            items = original_items.copy()
-            pseudo_random_items = deque()
-            random.shuffle(items)
-            last_item = None
-            bubble_fails = 0
-            while bubble_fails <= len(items):
-                try:
-                    item = items.popleft()
-                except IndexError:
-                    break
-                if not last_item or last_item.condition != item.condition:
-                    pseudo_random_items.append(item)
-                    bubble_fails = 0
-                else:
-                    items.append(item)
-                    bubble_fails += 1
-                last_item = item
-            if len(items) == 0:
-                return pseudo_random_items
-            n_tries -= 1
-        raise RuntimeError('Unable to compute alternating conditions.')
-
-    def _pseudo_randomized_materials_items(self, block_items, materials_dict):
-        items_by_materials = {}
-        for id, materials_items in groupby(block_items, lambda x: x.materials_id):
-            items = list(materials_items)
-            if materials_dict[id].is_filler or materials_dict[id].condition_count == 1:
-                random.shuffle(items)
-            else:
-                items = self._materials_items_with_alternating_conditions(items)
-            items_by_materials[id] = items
-        return items_by_materials
-
-    def _generate_items_pseudo_random(self, block_items, block_offset, block_slots, materials_dict):
-        questionnaire_items = []
-        if len(block_slots) != len(block_items):
-            raise RuntimeError('Block does not match master slots.')
-        items_by_materials = self._pseudo_randomized_materials_items(block_items, materials_dict)
-        for i, slot_materials in enumerate(block_slots):
-            item = items_by_materials[slot_materials].pop()
-            if not item:
-                raise RuntimeError('Block does not match master slots.')
-            questionnaire_item = QuestionnaireItem(
-                number=block_offset + i,
-                questionnaire=self,
-                item=item,
-            )
-            questionnaire_items.append(questionnaire_item)
-        return questionnaire_items
-
-    PSEUDO_RANDOMIZE_SLOT_TRIES = 1000
-
-    def _compute_block_slots(self, block_items, materials_dict):
-        filler = list([id for id, materials in materials_dict.items() if materials.is_filler])
-        n_tries = self.PSEUDO_RANDOMIZE_SLOT_TRIES
-        while n_tries > 0:
-            slots = []
-            items = block_items.copy()
-            random.shuffle(items)
-            colliding = []
-            last_item = None
-            for item in items:
-                if (
-                        item.materials_id in filler
-                        or not last_item
-                        or last_item.materials_id in filler
-                        or last_item.materials_id != item.materials_id
-                ):
-                    slots.append(item.materials_id)
-                else:
-                    colliding.append(item)
-                last_item = item
-            resolution_failed = False
-            for item in colliding:
-                slot_size = len(slots)
-                n_insert_tries = int(slot_size / 4)
-                while n_insert_tries > 0:
-                    pos = random.randint(0, slot_size - 2)
-                    if item.materials_id != slots[pos] and item.materials_id != slots[pos + 1]:
-                        slots.insert(pos + 1, item.materials_id)
-                        break
-                    n_insert_tries -= 1
-                if n_insert_tries == 0:
-                    resolution_failed = True
-            if not resolution_failed:
-                return slots
-            else:
-                n_tries -= 1
-        raise RuntimeError('Unable to compute slots.')
-
-    def _compute_slots(self, materials_dict, block_randomization, items_by_block):
-        slots = {}
-        for block, block_items in items_by_block.items():
-            block_items = list(block_items)
-            if block_randomization[block] == QuestionnaireBlock.RANDOMIZATION_PSEUDO:
-                slots[block] = self._compute_block_slots(block_items, materials_dict)
-        return slots
-
-    def _has_pseudo_randomization(self, block_randomization):
-        return any(
-            randomization for randomization in block_randomization.values()
-            if randomization == QuestionnaireBlock.RANDOMIZATION_PSEUDO
-        )
-
-    def generate_questionnaire_items(self, study, materials_list, items_by_block, block_randomization):
-        questionnaire_items = []
-        random.seed()
-        materials_dict = {e.id: e for e in materials_list}
-        if self._has_pseudo_randomization(block_randomization):
-            slots = self._compute_slots(materials_dict, block_randomization, items_by_block)
-        block_offset = 0
-        for block, block_items in sorted(items_by_block.items()):
-            if block_randomization[block] == QuestionnaireBlock.RANDOMIZATION_TRUE:
-                questionnaire_items.extend(self._generate_items_random(block_items, block_offset))
-            elif block_randomization[block] == QuestionnaireBlock.RANDOMIZATION_PSEUDO:
-                questionnaire_items.extend(
-                    self._generate_items_pseudo_random(block_items, block_offset, slots[block], materials_dict)
-                )
-            else:
-                questionnaire_items.extend(self._generate_block_items(block_items, block_offset))
-            block_offset += len(block_items)
-        return questionnaire_items
-
-    def _random_question_permutations(self, questions, n_items):
-        questions = [question.number for question in questions]
-        question_permutations = list(permutations(questions))
-        n_permutations = len(question_permutations)
-        per_permutation = ceil(n_items/n_permutations)
-        question_permutations = per_permutation*question_permutations
-        random.shuffle(question_permutations)
-        return question_permutations
-
-    def randomize_question_order(self, questions, questionnaire_items):
-        n_items = len(questionnaire_items)
-        question_permutations = self._random_question_permutations(questions, n_items)
-        for questionnaire_item, permutation in zip(questionnaire_items, question_permutations):
-            questionnaire_item.question_order = ','.join(str(p) for p in permutation)
-
-    def _random_scale_permutations(self, question, n_items):
-        scale = range(0, question.scale_values.count())
-        scale_permutations = list(permutations(scale))
-        n_permutations = len(scale_permutations)
-        per_permutation = ceil(n_items/n_permutations)
-        scale_permutations = per_permutation*scale_permutations
-        random.SystemRandom().shuffle(scale_permutations)
-        return scale_permutations
-
-    def _randomize_question_scales(self, questions, questionnaire_items):
-        n_items = len(questionnaire_items)
-        question_properties = []
-        for question in questions:
-            if question.randomize_scale:
-                scale_permutations = self._random_scale_permutations(question, n_items)
-                for questionnaire_item, permutation in zip(questionnaire_items, scale_permutations):
-                    question_property = QuestionProperty(
-                        number=question.number,
-                        questionnaire_item=questionnaire_item,
-                        scale_order=','.join(str(p) for p in permutation)
-                    )
-                    question_properties.append(question_property)
-        return question_properties
-
-    def generate_question_properties(self, questions, questionnaire_items):
-        return self._randomize_question_scales(questions, questionnaire_items)
-
     def __str__(self):
         return str(self.number)
 
@@ -269,9 +236,9 @@ class QuestionnaireBlock(models.Model):
         blank=True,
         null=True,
     )
-    RANDOMIZATION_PSEUDO = 'pseudo'
-    RANDOMIZATION_NONE = 'none'
-    RANDOMIZATION_TRUE = 'true'
+    RANDOMIZATION_PSEUDO = randomization.RANDOMIZATION_PSEUDO
+    RANDOMIZATION_NONE = randomization.RANDOMIZATION_NONE
+    RANDOMIZATION_TRUE = randomization.RANDOMIZATION_TRUE
     RANDOMIZATION_BASE = (
         (RANDOMIZATION_TRUE, 'Randomize'),
         (RANDOMIZATION_NONE, 'Keep item order'),
@@ -297,7 +264,10 @@ class QuestionnaireBlock(models.Model):
 
     def save(self, *args, **kwargs):
         strip_html_in_markdown_fields(QuestionnaireBlock, self)
-        return super().save(*args, **kwargs)
+        result = super().save(*args, **kwargs)
+        render_markdown_fields(QuestionnaireBlock, self)
+        self.study.bump_version()
+        return result
 
     def __str__(self):
         return str(self.block)
@@ -367,9 +337,41 @@ class Trial(models.Model):
     is_test = models.BooleanField(
         default=False,
     )
+    number = models.IntegerField(
+        blank=True,
+        null=True,
+        editable=False,
+    )
+    ratings_completed = models.IntegerField(
+        default=0,
+        editable=False,
+    )
+    last_activity = models.DateTimeField(
+        blank=True,
+        null=True,
+    )
+    STATUS_ACTIVE = 'active'
+    STATUS_FINISHED = 'finished'
+    STATUS_TEST = 'test'
+    STATUS = (
+        (STATUS_ACTIVE, 'Active'),
+        (STATUS_FINISHED, 'Finished'),
+        (STATUS_TEST, 'Test'),
+    )
+    status = models.CharField(
+        max_length=10,
+        choices=STATUS,
+        default=STATUS_ACTIVE,
+        help_text='Active, finished or test. Active trials without activity for an hour count as abandoned, '
+                  'which is derived from the last activity and not stored.',
+    )
 
     class Meta:
         ordering = ['created']
+        indexes = [
+            models.Index(fields=['status', 'last_activity']),
+            models.Index(fields=['questionnaire', 'is_test', 'number']),
+        ]
 
     def save(self, *args, **kwargs):
         if (
@@ -378,39 +380,35 @@ class Trial(models.Model):
         ):
             random.seed()
             self.participant_id = ''.join(random.choice(string.ascii_uppercase + string.digits) for _ in range(8))
+        if not self.last_activity:
+            self.last_activity = self.created
+        if self.is_test:
+            self.status = self.STATUS_TEST
+        if self.number is None:
+            with transaction.atomic():
+                self.number = self.questionnaire.study.next_trial_number(is_test=self.is_test)
+                return super().save(*args, **kwargs)
         return super().save(*args, **kwargs)
 
-    @cached_property
-    def number(self):
-        return Trial.objects.filter(
-            questionnaire__study=self.questionnaire.study, is_test=self.is_test, created__lt=self.created,
-        ).count() + 1
-
     @cached_property
     def items(self):
         return self.questionnaire.items
 
-    @cached_property
-    def ratings_completed(self):
-        return Rating.objects.filter(trial=self, question=0).count()
-
     @cached_property
     def ratings_count(self):
-        return len(self.items)
+        return len(self.questionnaire.participation_plan)
+
+    def questionnaire_block(self, num):
+        block = self.questionnaire.participation_plan.block(num)
+        if block is None:
+            return None
+        return self.questionnaire.study.participation_bundle.questionnaire_block(block)
 
     @cached_property
     def current_block(self):
-        questionnaire_item = QuestionnaireItem.objects.get(
-            questionnaire=self.questionnaire,
-            number=self.ratings_completed
-        )
-        questionnaire_block = QuestionnaireBlock.objects.get(
-            study=self.questionnaire.study,
-            block=questionnaire_item.item.materials_block
-        )
-        return questionnaire_block
+        return self.questionnaire_block(self.ratings_completed)
 
-    @cached_property
+    @property
     def is_finished(self):
         return self.ratings_completed == self.ratings_count
 
@@ -421,20 +419,50 @@ class Trial(models.Model):
 
     ABANDONED_AFTER_HRS = 1
 
+    @classmethod
+    def abandoned_before(cls):
+        return timezone.now() - timedelta(hours=cls.ABANDONED_AFTER_HRS)
+
     @property
     def is_abandoned(self):
-        if not self.is_finished:
-            latest_rating = self.rating_set.exclude(created=None).order_by('created').last()
-            if latest_rating:
-                last_time_active = latest_rating.created
-            else:
-                last_time_active = self.created
-            return last_time_active + timedelta(hours=self.ABANDONED_AFTER_HRS) < timezone.now()
-        return False
+        # the same condition as Study.trials_abandoned
+        if self.status != self.STATUS_ACTIVE:
+            return False
+        last_time_active = self.last_activity or self.created
+        return last_time_active < self.abandoned_before()
+
+    def compute_status(self, ratings_completed):
+        if self.is_test:
+            return self.STATUS_TEST
+        if ratings_completed >= self.ratings_count:
+            return self.STATUS_FINISHED
+        return self.STATUS_ACTIVE
+
+    def rating_completed(self, created, count=1):
+        self.ratings_completed += count
+        self.last_activity = created
+        self.status = self.compute_status(self.ratings_completed)
+        Trial.objects.filter(pk=self.pk).update(
+            ratings_completed=models.F('ratings_completed') + count,
+            last_activity=self.last_activity,
+            status=self.status,
+        )
+
+    def update_progress(self):
+        ratings = self.rating_set.filter(question=0)
+        self.ratings_completed = ratings.count()
+        latest_rating = ratings.exclude(created=None).order_by('created').last()
+        self.last_activity = latest_rating.created if latest_rating else self.created
+        self.status = self.compute_status(self.ratings_completed)
+        self.save(update_fields=['ratings_completed', 'last_activity', 'status'])
 
     def init(self, study):
-        self.questionnaire = study.next_questionnaire(is_test=self.is_test)
-        self.save()
+        with transaction.atomic():
+            self.questionnaire = study.next_questionnaire(is_test=self.is_test)
+            self.save()
+        self.questionnaire.materialize()
+        # build the plan before the first rating page is requested
+        self.questionnaire.participation_plan
 
     def get_absolute_url(self):
         return reverse('trial', args=[self.slug])
@@ -468,6 +496,47 @@ class Rating(models.Model):
         return self.questionnaire_item.questionnaire.study.questions.get(number=self.question)
 
 
+class RatingAggregate(models.Model):
+    materials = models.ForeignKey(
+        'lrex_materials.Materials',
+        on_delete=models.CASCADE,
+        related_name='rating_aggregates',
+    )
+    item = models.ForeignKey(item_models.Item, on_delete=models.CASCADE)
+    condition = models.CharField(max_length=16)
+    trial = models.ForeignKey(Trial, on_delete=models.CASCADE)
+    participant = models.IntegerField()
+    question = models.IntegerField()
+    scale_value = models.ForeignKey(study_models.ScaleValue, on_delete=models.CASCADE)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ['materials', 'item', 'trial', 'question', 'scale_value']
+        indexes = [
+            models.Index(fields=['materials', 'condition']),
+            models.Index(fields=['materials', 'participant', 'condition']),
+        ]
+
+    @classmethod
+    def add_ratings(cls, trial, ratings):
+        """Must be called inside the transaction that saves the ratings."""
+        if not settings.LREX_RATING_AGGREGATE_TABLE:
+            return
+        cls.objects.bulk_create([
+            cls(
+                materials_id=rating.questionnaire_item.item.materials_id,
+                item_id=rating.questionnaire_item.item_id,
+                condition=rating.questionnaire_item.item.condition,
+                trial=trial,
+                participant=trial.number,
+                question=rating.question,
+                scale_value_id=rating.scale_value_id,
+                count=1,
+            )
+            for rating in ratings
+        ])
+
+
 class DemographicValue(models.Model):
     trial = models.ForeignKey(Trial, on_delete=models.CASCADE, related_name='demographics')
     field = models.ForeignKey(study_models.DemographicField, on_delete=models.CASCADE)
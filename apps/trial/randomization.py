@@ -0,0 +1,208 @@
+"""
+Questionnaire item order and question and scale permutations, computed on plain tuples. The module does not depend
+on Django, so that questionnaires can be generated in worker processes.
+"""
+import random
+from collections import Counter, namedtuple
+from itertools import groupby
+from math import ceil, factorial
+
+
+RANDOMIZATION_PSEUDO = 'pseudo'
+RANDOMIZATION_NONE = 'none'
+RANDOMIZATION_TRUE = 'true'
+
+Item = namedtuple('Item', ['id', 'materials_id', 'condition'])
+Materials = namedtuple('Materials', ['title', 'is_filler', 'condition_count'])
+Question = namedtuple('Question', ['number', 'scale_size', 'randomize_scale'])
+GeneratedQuestionnaire = namedtuple(
+    'GeneratedQuestionnaire', ['number', 'item_ids', 'item_blocks', 'question_orders', 'scale_orders'],
+)
+
+
+def alternating_sequence(counts, free=frozenset(), rng=random):
+    """
+    Random sequence of the keys of counts, each repeated counts[key] times, in which only free keys may follow
+    themselves. No key outside of free may take more than half of the sequence (rounded up).
+    """
+    # random pick in O(n * keys), weighted by the remaining repetitions relative to the items left to separate them
+    # and forced to the key that would otherwise be left with too many repetitions
+    remaining = {key: count for key, count in counts.items() if count}
+    sequence = []
+    last = None
+    for n_remaining in range(sum(remaining.values()), 0, -1):
+        candidates = [key for key in remaining if key != last]
+        max_remaining = n_remaining // 2
+        forced = [key for key in candidates if key not in free and remaining[key] > max_remaining]
+        if forced:
+            key = forced[0]
+        else:
+            weights = [
+                remaining[key] / n_remaining if key in free else remaining[key] / (n_remaining - 2 * remaining[key] + 2)
+                for key in candidates
+            ]
+            key = rng.choices(candidates, weights=weights)[0]
+        sequence.append(key)
+        remaining[key] -= 1
+        if not remaining[key]:
+            del remaining[key]
+        last = None if key in free else key
+    return sequence
+
+
+def _check_alternating_conditions(n_items_by_condition, materials, questionnaire_number):
+    condition, n_condition_items = max(n_items_by_condition.items(), key=lambda x: x[1])
+    n_items = sum(n_items_by_condition.values())
+    if n_condition_items > ceil(n_items / 2):
+        raise RuntimeError(
+            'Unable to alternate conditions: {} of {} items of materials "{}" in questionnaire {} have condition '
+            '"{}", at most {} can.'.format(
+                n_condition_items, n_items, materials.title, questionnaire_number, condition, ceil(n_items / 2),
+            )
+        )
+
+
+def materials_items_with_alternating_conditions(materials_items, materials, questionnaire_number, rng=random):
+    items_by_condition = {}
+    for item in materials_items:
+        items_by_condition.setdefault(item.condition, []).append(item)
+    n_items_by_condition = {condition: len(items) for condition, items in items_by_condition.items()}
+    _check_alternating_conditions(n_items_by_condition, materials, questionnaire_number)
+    for items in items_by_condition.values():
+        rng.shuffle(items)
+    conditions = alternating_sequence(n_items_by_condition, rng=rng)
+    return [items_by_condition[condition].pop() for condition in conditions]
+
+
+def _check_block_slots(n_items_by_materials, filler, materials_dict, block):
+    experimental = [id for id in n_items_by_materials if id not in filler]
+    if experimental:
+        id = max(experimental, key=n_items_by_materials.get)
+        n_items = sum(n_items_by_materials.values())
+        max_items = ceil(n_items / 2)
+        if n_items_by_materials[id] > max_items:
+            raise RuntimeError(
+                'Unable to compute slots: {} of {} items in block {} belong to materials "{}", at most {} can '
+                'without two of them in a row. Add more filler items and retry.'.format(
+                    n_items_by_materials[id], n_items, block, materials_dict[id].title, max_items,
+                )
+            )
+
+
+def block_slots(block_items, materials_dict, block, rng=random):
+    n_items_by_materials = Counter(item.materials_id for item in block_items)
+    filler = frozenset(id for id in n_items_by_materials if materials_dict[id].is_filler)
+    _check_block_slots(n_items_by_materials, filler, materials_dict, block)
+    return alternating_sequence(n_items_by_materials, free=filler, rng=rng)
+
+
+def _pseudo_randomized_materials_items(block_items, materials_dict, questionnaire_number, rng):
+    items_by_materials = {}
+    for id, materials_items in groupby(block_items, lambda x: x.materials_id):
+        items = list(materials_items)
+        materials = materials_dict[id]
+        if materials.is_filler or materials.condition_count == 1:
+            rng.shuffle(items)
+        else:
+            items = materials_items_with_alternating_conditions(items, materials, questionnaire_number, rng)
+        items_by_materials[id] = items
+    return items_by_materials
+
+
+def _pseudo_random_block_items(block_items, block, materials_dict, questionnaire_number, rng):
+    slots = block_slots(block_items, materials_dict, block, rng)
+    items_by_materials = _pseudo_randomized_materials_items(block_items, materials_dict, questionnaire_number, rng)
+    return [items_by_materials[slot_materials].pop() for slot_materials in slots]
+
+
+def questionnaire_item_order(items_by_block, materials_dict, block_randomization, questionnaire_number, rng=random):
+    """Returns the items of a questionnaire in order, and the block of each of them."""
+    items = []
+    item_blocks = []
+    for block, block_items in sorted(items_by_block.items()):
+        block_items = list(block_items)
+        if block_randomization[block] == RANDOMIZATION_TRUE:
+            rng.shuffle(block_items)
+        elif block_randomization[block] == RANDOMIZATION_PSEUDO:
+            block_items = _pseudo_random_block_items(
+                block_items, block, materials_dict, questionnaire_number, rng,
+            )
+        items.extend(block_items)
+        item_blocks.extend([block] * len(block_items))
+    return items, item_blocks
+
+
+def nth_permutation(values, rank):
+    """Permutation of values at position rank in the order of itertools.permutations(values)."""
+    values = list(values)
+    permutation = []
+    for i in range(len(values), 0, -1):
+        # digits of the Lehmer code in the factorial number system
+        index, rank = divmod(rank, factorial(i - 1))
+        permutation.append(values.pop(index))
+    return tuple(permutation)
+
+
+def _random_permutations(values, n_items, rng):
+    # draws n_items ranks out of ceil(n_items / n!) copies of all n! permutations, so that no permutation is used
+    # more often than needed, without listing the permutations
+    values = list(values)
+    n_permutations = factorial(len(values))
+    per_permutation = ceil(n_items / n_permutations)
+    ranks = [rank % n_permutations for rank in rng.sample(range(per_permutation * n_permutations), n_items)]
+    permutations_by_rank = {rank: nth_permutation(values, rank) for rank in set(ranks)}
+    return [permutations_by_rank[rank] for rank in ranks]
+
+
+def question_orders(questions, n_items, rng=random):
+    question_numbers = [question.number for question in questions]
+    return [
+        ','.join(str(p) for p in permutation)
+        for permutation in _random_permutations(question_numbers, n_items, rng)
+    ]
+
+
+def scale_orders(questions, n_items, rng=random):
+    """Returns (item index, question number, scale order) rows for the questions with a random scale."""
+    rows = []
+    for question in questions:
+        if question.randomize_scale:
+            scale_permutations = _random_permutations(range(question.scale_size), n_items, rng)
+            for i, permutation in enumerate(scale_permutations):
+                rows.append((i, question.number, ','.join(str(p) for p in permutation)))
+    return rows
+
+
+def generate_questionnaire(
+        questionnaire_number, items_by_block, block_randomization, seed, materials_dict, questions,
+        randomize_question_order, randomize_scales,
+):
+    """Item order, question orders and scale orders of a questionnaire, the same for the same seed and input."""
+    rng = random.Random(seed)
+    items, item_blocks = questionnaire_item_order(
+        items_by_block, materials_dict, block_randomization, questionnaire_number, rng,
+    )
+    return GeneratedQuestionnaire(
+        number=questionnaire_number,
+        item_ids=[item.id for item in items],
+        item_blocks=item_blocks,
+        question_orders=(
+            question_orders(questions, len(items), rng) if randomize_question_order else [None] * len(items)
+        ),
+        scale_orders=scale_orders(questions, len(items), rng) if randomize_scales else [],
+    )
+
+
+def check_questionnaire(questionnaire_number, items_by_block, block_randomization, materials_dict):
+    """Raises the RuntimeError generate_questionnaire would raise for any seed, without ordering the items."""
+    for block, block_items in items_by_block.items():
+        if block_randomization[block] != RANDOMIZATION_PSEUDO:
+            continue
+        n_items_by_materials = Counter(item.materials_id for item in block_items)
+        filler = frozenset(id for id in n_items_by_materials if materials_dict[id].is_filler)
+        _check_block_slots(n_items_by_materials, filler, materials_dict, block)
+        for id, materials_items in groupby(block_items, lambda x: x.materials_id):
+            materials = materials_dict[id]
+            if not materials.is_filler and materials.condition_count > 1:
+                n_items_by_condition = Counter(item.condition for item in materials_items)
+                _check_alternating_conditions(n_items_by_condition, materials, questionnaire_number)
@@ -1,11 +1,11 @@
 from itertools import groupby
-from markdownx.utils import markdownify
 
 from django.contrib import messages
 from django.conf import settings
 from django.core.paginator import Paginator
+from django.db import transaction
 from django.db.utils import IntegrityError
-from django.http import HttpResponse
+from django.http import Http404
 from django.shortcuts import redirect
 from django.utils.safestring import mark_safe
 from django.utils.timezone import now
@@ -14,7 +14,10 @@ from django.utils.functional import cached_property
 from django.views import generic
 
 from apps.contrib import csv as contrib_csv
+from apps.contrib.markdown import markdownify
 from apps.contrib import views as contrib_views
+from apps.item import models as item_models
+from apps.study import models as study_models
 from apps.study import views as study_views
 
 from . import forms
@@ -64,7 +67,7 @@ class TrialMixin:
     def trial(self):
         if not self.trial_object:
             trial_slug = self.kwargs['trial_slug']
-            self.trial_object = models.Trial.objects.get(slug=trial_slug)
+            self.trial_object = models.Trial.objects.select_related('questionnaire__study').get(slug=trial_slug)
         return self.trial_object
 
     def get_context_data(self, **kwargs):
@@ -151,8 +154,8 @@ class QuestionnaireListView(
             try:
                 self.study.generate_questionnaires()
                 messages.success(request, 'Questionnaires generated.')
-            except RuntimeError:
-                messages.error(request, 'Pseudo-randomization timed out. Retry or add more filler items and retry.')
+            except RuntimeError as error:
+                messages.error(request, 'Pseudo-randomization failed. {}'.format(error))
         return redirect('questionnaires',study_slug=self.study.slug)
 
     def get_queryset(self):
@@ -179,7 +182,29 @@ class QuestionnaireDetailView(
     def _items_for_block(self, block, q_items):
         return [(block, q_item, q_item.question_properties.all()) for q_item in q_items]
 
+    def _derived_context_questionnaire_items(self):
+        derived = self.study.derive_questionnaires([self.questionnaire])[0]
+        items = item_models.Item.objects.select_related('materials').in_bulk(derived.item_ids)
+        scale_orders = {}
+        for i, number, scale_order in derived.scale_orders:
+            scale_orders.setdefault(i, []).append((number, scale_order))
+        context_items = []
+        for i, (item_id, block, question_order) in enumerate(
+                zip(derived.item_ids, derived.item_blocks, derived.question_orders)
+        ):
+            q_item = models.QuestionnaireItem(
+                number=i, questionnaire=self.questionnaire, item=items[item_id], question_order=question_order,
+            )
+            question_properties = [
+                models.QuestionProperty(number=number, questionnaire_item=q_item, scale_order=scale_order)
+                for number, scale_order in sorted(scale_orders.get(i, []))
+            ]
+            context_items.append((block, q_item, question_properties))
+        return context_items
+
     def _context_questionnaire_items(self):
+        if not self.questionnaire.materialized:
+            return self._derived_context_questionnaire_items()
         context_items = []
         if self.study.use_blocks:
             questionnaire_items = self.questionnaire.questionnaire_items.prefetch_related('question_properties').all()
@@ -246,8 +271,8 @@ class QuestionnaireGenerateView(
         try:
             self.study.generate_questionnaires()
             messages.success(self.request, 'Questionnaires generated.')
-        except RuntimeError:
-            messages.error(self.request, 'Pseudo-randomization timed out. Retry or add more filler items and retry.')
+        except RuntimeError as error:
+            messages.error(self.request, 'Pseudo-randomization failed. {}'.format(error))
 
 
 class QuestionnaireDeleteAllView(
@@ -348,14 +373,14 @@ class QuestionnaireUploadView(
         return reverse('questionnaires', args=[self.study.slug])
 
 
-class QuestionnaireCSVDownloadView(study_views.StudyMixin, study_views.CheckStudyCreatorMixin, generic.View):
-
-    def get(self, request, *args, **kwargs):
-        filename = '{}_QUESTIONNAIRES_{}.csv'.format(self.study.title.replace(' ', '_'), str(now().date()))
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; filename="' + filename + '"'
-        self.study.questionnaires_csv(response)
-        return response
+class QuestionnaireCSVDownloadView(
+    study_views.StudyMixin,
+    study_views.CheckStudyCreatorMixin,
+    study_views.SnapshotDownloadMixin,
+    generic.View,
+):
+    export_type = study_models.ExportJob.EXPORT_QUESTIONNAIRES
+    stream_snapshot = True
 
 
 class TrialListView(
@@ -388,22 +413,18 @@ class TrialListView(
         return redirect('trials', study_slug=self.study.slug)
 
     def get_queryset(self):
-        queryset = models.Trial.objects.filter(questionnaire__study=self.study).prefetch_related('questionnaire')
+        queryset = models.Trial.objects.filter(questionnaire__study=self.study).select_related('questionnaire')
         return queryset
 
 
 class TrialParticipantsCSVDownloadView(
     study_views.StudyMixin,
     study_views.CheckStudyCreatorMixin,
+    study_views.SnapshotDownloadMixin,
     generic.View,
 ):
-
-    def get(self, request, *args, **kwargs):
-        filename = '{}_PARTICIPANTS_{}.csv'.format(self.study.title.replace(' ', '_'), now().strftime('%Y-%m-%d-%H%M'))
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; filename="' + filename + '"'
-        self.study.participant_information_csv(response)
-        return response
+    export_type = study_models.ExportJob.EXPORT_PARTICIPANTS
+    stream_snapshot = True
 
 
 class TrialDeleteParticipantsView(
@@ -439,7 +460,7 @@ class TrialDeleteAllView(
         return reverse('trials', args=[self.study.slug])
 
     def post(self, request, *args, **kwargs):
-        models.Trial.objects.filter(questionnaire__study=self.study).delete()
+        self.study.delete_trials()
         messages.success(self.request, 'All trials deleted.')
         return redirect(self.get_success_url())
 
@@ -618,6 +639,11 @@ class TrialDeleteView(
     model = models.Trial
     template_name = 'lrex_dashboard/results_confirm_delete.html'
 
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        self.study.update_questionnaire_trial_counts()
+        return result
+
     def get_success_url(self):
         return reverse('trials', args=[self.study.slug])
 
@@ -634,8 +660,8 @@ class TrialHomeView(study_views.StudyMixin, generic.TemplateView):
 class ProgressMixin:
 
     def get_context_data(self, **kwargs):
-        num = kwargs['num']
-        count = kwargs['n_trial_items']
+        num = int(self.kwargs['num'])
+        count = len(self.trial.questionnaire.participation_plan)
         context = super().get_context_data(**kwargs)
         context.update({
             'progress_i': num,
@@ -645,7 +671,19 @@ class ProgressMixin:
         return context
 
 
-class RatingsCreateView(ProgressMixin, TestTrialMixin, TrialMixin, contrib_views.FormsetView):
+class RatingNumMixin:
+
+    def _redirect_to_correct_num(self, num):
+        if self.trial.is_test:
+            return None
+        if self.trial.is_finished:
+            return reverse('rating-taken', args=[self.trial.slug])
+        if self.trial.ratings_completed != num:
+            return reverse('ratings-create', args=[self.trial.slug, self.trial.ratings_completed])
+        return None
+
+
+class RatingsCreateView(RatingNumMixin, ProgressMixin, TestTrialMixin, TrialMixin, contrib_views.FormsetView):
     model = models.Rating
     template_name = 'lrex_trial/rating_form.html'
     formset_factory = forms.RatingFormsetFactory
@@ -657,31 +695,34 @@ class RatingsCreateView(ProgressMixin, TestTrialMixin, TrialMixin, contrib_views
         return self.trial.rating_set.none()
 
     def get_form_count(self):
-        return self.study.questions.count()
+        return len(self.study.participation_bundle) * len(self.questionnaire_items)
 
     def get_form_kwargs(self):
         kwargs = super().get_form_kwargs()
         kwargs.update({
-            'questionnaire_item': self.questionnaire_item,
+            'questionnaire_items': self.questionnaire_items,
         })
         return kwargs
 
     def save_form(self, form, number):
         form.instance.trial = self.trial
-        form.instance.questionnaire_item = self.questionnaire_item
-        try:
-            super().save_form(form, number)
-        except IntegrityError:
-            return redirect(self.get_next_url())
+        form.instance.questionnaire_item = form.questionnaire_item
+        self.ratings.append(form.instance)
 
     def submit_redirect(self):
         if self.is_last:
             self.trial.ended = now()
-            self.trial.save()
+            self.trial.save(update_fields=['ended'])
         return redirect(self.get_next_url())
 
     def formset_valid(self):
-        pass
+        try:
+            with transaction.atomic():
+                models.Rating.objects.bulk_create(self.ratings)
+                models.RatingAggregate.add_ratings(self.trial, self.ratings)
+                self.trial.rating_completed(self.ratings[-1].created, count=len(self.questionnaire_items))
+        except IntegrityError:
+            pass
 
     def formset_invalid(self):
         if any('scale_value' in form_errors for form_errors in self.formset.errors):
@@ -689,90 +730,93 @@ class RatingsCreateView(ProgressMixin, TestTrialMixin, TrialMixin, contrib_views
         if any('feedbacks_given' in form_errors for form_errors in self.formset.errors):
             messages.error(self.request, self.study.feedback_message)
 
+    @cached_property
+    def participation_plan(self):
+        return self.trial.questionnaire.participation_plan
+
+    @cached_property
+    def page_end(self):
+        return self.participation_plan.page_end(self.num, self.study.items_per_page)
+
     def dispatch(self, request, *args, **kwargs):
         self.num = int(self.kwargs['num'])
         redirect_link = self._redirect_to_correct_num(self.num)
         if redirect_link:
             return redirect(redirect_link)
-        self.questionnaire_item = models.QuestionnaireItem.objects.prefetch_related(
-            'item',
-            'item__item_questions',
-            'question_properties',
-        ).get(
-            questionnaire=self.trial.questionnaire,
-            number=self.num
+        self.questionnaire_items = list(
+            models.QuestionnaireItem.objects.select_related(
+                'item',
+                'item__textitem',
+                'item__markdownitem',
+                'item__audiolinkitem',
+            ).prefetch_related(
+                'question_properties',
+            ).filter(
+                pk__in=self.participation_plan.questionnaire_item_ids[self.num:self.page_end],
+            ).order_by('number')
         )
+        if not self.questionnaire_items:
+            raise Http404
+        self.ratings = []
         return super().dispatch(request, *args, **kwargs)
 
     def get_context_data(self, **kwargs):
         kwargs.update(
             {
                 'continue_label': self.study.continue_label,
-                'n_trial_items': len(self.trial.items), 'num': self.num,
-                'item': self.questionnaire_item.item,
             }
         )
         context = super().get_context_data(**kwargs)
+        question_count = len(self.study.participation_bundle)
+        forms = list(self.formset)
         context.update({
             'contact': mark_safe(self.study.contact),
             'use_vertical_scale_layout': self.study.use_vertical_scale_layout,
+            'page_items': [
+                (questionnaire_item.item, forms[i * question_count:(i + 1) * question_count])
+                for i, questionnaire_item in enumerate(self.questionnaire_items)
+            ],
         })
         if self.study.short_instructions:
             context['short_instructions_rich'] = mark_safe(markdownify(self.study.short_instructions))
-        if self.study.use_blocks and self.trial.current_block.short_instructions:
-            context['short_block_instructions_rich'] = mark_safe(markdownify(self.trial.current_block.short_instructions))
+        if self.study.use_blocks:
+            questionnaire_block = self.trial.questionnaire_block(self.num)
+            if questionnaire_block and questionnaire_block.short_instructions:
+                context['short_block_instructions_rich'] = mark_safe(
+                    markdownify(questionnaire_block.short_instructions)
+                )
         return context
 
-    def _redirect_to_correct_num(self, num):
-        if self.trial.is_test:
-            return None
-        if self.trial.is_finished:
-            return reverse('rating-taken', args=[self.trial.slug])
-        try:
-            n_ratings = models.Rating.objects.filter(trial=self.trial, question=0).count()
-            if n_ratings != num:
-                return reverse('ratings-create', args=[self.trial.slug, n_ratings])
-        except models.Rating.DoesNotExist:
-            pass
-        return None
-
     @cached_property
     def is_last(self):
-        trial_items = self.trial.items
-        return self.num == len(trial_items) - 1
+        return self.participation_plan.is_last(self.page_end - 1)
 
     def get_next_url(self):
-        if not self.is_last:
-            trial_items = self.trial.items
-            if (
-                    self.study.use_blocks
-                    and trial_items[self.num].materials_block != trial_items[self.num + 1].materials_block
-            ):
-                url = reverse('rating-block-instructions', args=[self.trial.slug, self.num + 1])
-            else:
-                url = reverse('ratings-create', args=[self.trial.slug, self.num + 1])
+        url_name = self.participation_plan.next_url_name(self.page_end - 1, self.study.use_blocks)
+        if url_name == 'rating-outro':
+            url = reverse(url_name, args=[self.trial.slug])
         else:
-            url = reverse('rating-outro', args=[self.trial.slug])
+            url = reverse(url_name, args=[self.trial.slug, self.page_end])
         url = self.test_url(url)
         return url
 
 
-class RatingBlockInstructionsView(ProgressMixin, TestTrialMixin, TrialMixin, generic.TemplateView):
+class RatingBlockInstructionsView(RatingNumMixin, ProgressMixin, TestTrialMixin, TrialMixin, generic.TemplateView):
     template_name = 'lrex_trial/rating_block_instructions.html'
 
     def get(self, request, *args, **kwargs):
-        self.questionnaire_block = self.trial.current_block
         num = int(self.kwargs['num'])
+        redirect_link = self._redirect_to_correct_num(num)
+        if redirect_link:
+            return redirect(redirect_link)
+        self.questionnaire_block = self.trial.questionnaire_block(num)
         self.next_url = reverse('ratings-create', args=[self.trial.slug, num])
         self.next_url = self.test_url(self.next_url)
-        if not self.questionnaire_block.instructions:
+        if not self.questionnaire_block or not self.questionnaire_block.instructions:
             return redirect(self.next_url)
         return super().get(request, *args, **kwargs)
 
     def get_context_data(self, **kwargs):
-        kwargs.update(
-            {'n_trial_items': len(self.trial.items)}
-        )
         context = super().get_context_data(**kwargs)
         context.update({
             'block_instructions_rich': mark_safe(markdownify(self.questionnaire_block.instructions)),
@@ -0,0 +1,34 @@
+function formatBytes(bytes) {
+    var units = ['bytes', 'KB', 'MB', 'GB'];
+    var i = 0;
+    while (bytes >= 1024 && i < units.length - 1) {
+        bytes /= 1024;
+        i++;
+    }
+    return (i == 0 ? bytes : bytes.toFixed(1)) + ' ' + units[i];
+}
+
+function pollExports() {
+    var pending = document.querySelectorAll('[data-export-status]');
+    if (pending.length == 0) return;
+    var requests = Array.prototype.map.call(pending, function (element) {
+        return fetch(element.dataset.exportStatus, {credentials: 'same-origin'})
+            .then(function (response) {
+                // a job is removed when another one exports the same data, the reload shows that one
+                if (!response.ok) return true;
+                return response.json().then(function (job) {
+                    element.querySelector('[data-export-field="status_display"]').textContent = job.status_display;
+                    element.querySelector('[data-export-field="bytes_written"]').textContent = formatBytes(job.bytes_written);
+                    return job.status == 'finished' || job.status == 'failed';
+                });
+            });
+    });
+    Promise.all(requests).then(function (done) {
+        if (done.indexOf(true) >= 0) window.location.reload();
+        else setTimeout(pollExports, 2000);
+    });
+}
+
+$(document).ready(function(){
+    setTimeout(pollExports, 2000);
+});
@@ -0,0 +1,3 @@
+DATABASES = {'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': '/tmp/lrex.sqlite3'}}
+ALLOWED_HOSTS = ['testserver', 'localhost']
+LREX_EXPORT_SNAPSHOT_DIR = '/tmp/lrex_snapshots'
@@ -154,6 +154,11 @@ LREX_RECIPIENT = ''
 LREX_IBAN = ''
 LREX_BIC = ''
 LREX_ANNOUNCEMENTS = []
+LREX_RATING_AGGREGATE_TABLE = True
+LREX_EXPORT_SNAPSHOT_DIR = os.path.join(BASE_DIR, 'export_snapshots')
+LREX_EXPORT_SNAPSHOT_MAX_BYTES = 1024 ** 3
+LREX_EXPORT_WORKER_THREADS = 0
+LREX_QUESTIONNAIRE_GENERATION_PROCESSES = 1
 
 # Import local settings
 try: